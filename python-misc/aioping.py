@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+    aioping
+    =======
+
+    Pings hosts from :mod:`asyncio` without blocking the event loop.
+
+    All coroutines of a loop share a single ICMP socket, which is watched
+    with :meth:`~asyncio.AbstractEventLoop.add_reader`.  The packets are
+    built by :func:`ping.sendOnePing`, and every request gets its own ID and
+    sequence pair so the replies can be told apart.
+
+    Like :mod:`ping`, this needs root privileges unless ICMP datagram sockets
+    are allowed.
+
+    Usage::
+
+        $ sudo python3 aioping.py -c 3 localhost example.com
+"""
+
+
+import socket
+import asyncio
+from argparse import ArgumentParser
+
+from ping import (ICMP_ECHO_REPLY, ICMP6_ECHO_REPLY, openIcmpSocket,
+                  enableTimestamps, receivePacket, ipHeaderSize,
+                  addressFamily, sendOnePing, unpackReply)
+
+
+class PingProtocol(object):
+    """Sends echo requests and dispatches the replies of an ICMP socket for
+    all coroutines of `loop`.
+
+    `kind` selects a raw or datagram socket and `family` IPv4 or IPv6 like
+    in :func:`ping.openIcmpSocket`.  If `timestamps` is true, the arrival
+    times of replies are taken from the kernel, so a busy loop doesn't add
+    to the delays.
+    """
+
+    def __init__(self, loop=None, kind=None, family=socket.AF_INET,
+                 timestamps=False):
+        self.loop = loop or asyncio.get_running_loop()
+        (self._socket, self._base_id) = openIcmpSocket(kind, family)
+        self._timestamps = timestamps and enableTimestamps(self._socket)
+        self._id_count = 0x10000 if self._socket.type == socket.SOCK_RAW else 1
+        self._socket.setblocking(False)
+        # Don't drop replies arriving in bursts, like ping.sweep().
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self._count = 0
+        #: Maps the (ID, sequence) pairs of pending requests to their
+        #: destination and the future for the delay.
+        self._waiters = {}
+        self.loop.add_reader(self._socket.fileno(), self._read_replies)
+
+    def _next_key(self):
+        while True:
+            key = ((self._base_id + (self._count >> 16) % self._id_count)
+                   & 0xFFFF,
+                   self._count & 0xFFFF)
+            self._count = (self._count + 1) & 0xFFFFFFFF
+            if key not in self._waiters:
+                return key
+
+    def _read_replies(self):
+        while True:
+            try:
+                (packet, address, time_received) = receivePacket(
+                    self._socket, 0, self._timestamps)
+            except (BlockingIOError, InterruptedError):
+                return
+            reply = unpackReply(packet, ipHeaderSize(self._socket, packet))
+            if reply is None:
+                continue
+            (type, packet_id, sequence, time_sent) = reply
+            waiter = self._waiters.get((packet_id, sequence))
+            # The raw socket sees all ICMP traffic of the host.
+            if (type not in (ICMP_ECHO_REPLY, ICMP6_ECHO_REPLY) or
+                    waiter is None or
+                    waiter[0] != address[0] or waiter[1].done()):
+                continue
+            waiter[1].set_result(time_received - time_sent)
+
+    async def ping_once(self, address, timeout=1):
+        """Sends a single echo request to `address`.
+
+        :returns: the delay in seconds, or `None` on timeout.
+        """
+        key = self._next_key()
+        future = self.loop.create_future()
+        self._waiters[key] = (address, future)
+        try:
+            sendOnePing(self._socket, address, *key)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            del self._waiters[key]
+
+    def close(self):
+        self.loop.remove_reader(self._socket.fileno())
+        self._socket.close()
+        for (_, future) in self._waiters.values():
+            future.cancel()
+
+
+#: Maps running loops to their protocols by address family.
+_protocols = {}
+
+
+async def _close_protocols(loop):
+    """Waits until cancelled, like by :func:`asyncio.run` before it closes
+    `loop`, and closes the protocols of `loop` then.
+    """
+    try:
+        await loop.create_future()
+    finally:
+        for protocol in _protocols.pop(loop).values():
+            protocol.close()
+
+
+def get_protocol(loop=None, family=socket.AF_INET):
+    """Returns the shared `PingProtocol` of `loop`, by default the running
+    loop, for the address `family`, and creates it on first use.
+
+    The protocols are closed when the tasks of `loop` are cancelled at its
+    end.  Loops which are closed without that should close them with
+    :meth:`PingProtocol.close` themselves.
+    """
+    loop = loop or asyncio.get_running_loop()
+    protocols = _protocols.get(loop)
+    if protocols is None:
+        protocols = _protocols[loop] = {}
+        loop.create_task(_close_protocols(loop))
+    protocol = protocols.get(family)
+    if protocol is None:
+        protocol = protocols[family] = PingProtocol(loop, family=family)
+    return protocol
+
+
+async def resolve(host, family=None):
+    """Returns an address of `host` without blocking, like
+    :func:`ping.resolve`.
+    """
+    loop = asyncio.get_running_loop()
+    families = (family,) if family else (socket.AF_INET, socket.AF_INET6)
+    for family in families:
+        try:
+            addresses = await loop.getaddrinfo(host, None, family=family,
+                                               type=socket.SOCK_RAW)
+        except socket.gaierror:
+            if family == families[-1]:
+                raise
+            continue
+        return addresses[0][4][0]
+
+
+async def ping(host, count=4, interval=1, timeout=1, protocol=None):
+    """Pings `host` `count` times, starting a new request every `interval`
+    seconds while earlier ones may still wait for their reply.
+
+    :returns: a list of the delays in seconds, with `None` for requests
+        which timed out after `timeout` seconds.
+    """
+    address = await resolve(host)
+    protocol = protocol or get_protocol(family=addressFamily(address))
+    requests = []
+    for index in range(count):
+        if index:
+            await asyncio.sleep(interval)
+        requests.append(asyncio.ensure_future(
+            protocol.ping_once(address, timeout)))
+    return await asyncio.gather(*requests)
+
+
+async def ping_all(hosts, count, interval, timeout):
+    results = await asyncio.gather(*[ping(host, count, interval, timeout)
+                                     for host in hosts])
+    for (host, delays) in zip(hosts, results):
+        print(host, ' '.join('timeout' if delay is None else
+                             '{:.3f} ms'.format(delay * 1000)
+                             for delay in delays))
+
+
+def main():
+    parser = ArgumentParser(description='Ping hosts concurrently.')
+    parser.add_argument('-c', '--count', type=int, default=4,
+                        help='Send COUNT requests to each host '
+                        '(default: %(default)s).')
+    parser.add_argument('-i', '--interval', type=float, default=1,
+                        help='Wait INTERVAL seconds between requests '
+                        '(default: %(default)s).')
+    parser.add_argument('-W', '--timeout', type=float, default=1,
+                        help='Wait TIMEOUT seconds for each reply '
+                        '(default: %(default)s).')
+    parser.add_argument('hosts', nargs='+', metavar='host')
+    args = parser.parse_args()
+    asyncio.run(ping_all(args.hosts, args.count, args.interval,
+                         args.timeout))
+
+
+if __name__ == '__main__':
+    main()
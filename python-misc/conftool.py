@@ -16,77 +16,264 @@ A simple script to edit INI-style configuration files from command line.
 
 import sys
 import os
+import re
+
+
+_SECTION_MARKER = re.compile(
+    r'^(\[+)\s*([^\s\'"\[\]][^\[\]]*?)\s*(\]+)\s*(?:#.*)?$')
+_OPTION = re.compile(r'^([^\'"=\[#][^=]*?)\s*=\s*(.*)$')
+
+
+def read_option(filename, sections, option):
+    """Returns the value of `option` in the section of `filename`, which
+    the names in `sections` point to, reading no further than needed.
+
+    Only sections and unquoted single values are understood.  `None` is
+    returned for anything else, like quotes, lists, interpolation or
+    syntax errors, and for missing options, to leave these to `ConfigObj`.
+    """
+    path = []
+    with open(filename, 'rb') as stream:
+        for line in stream:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('\xef\xbb\xbf'):
+                # A byte order mark
+                return None
+            if line.startswith('['):
+                match = _SECTION_MARKER.match(line)
+                if (match is None or
+                        len(match.group(1)) != len(match.group(3)) or
+                        len(match.group(1)) > len(path) + 1):
+                    return None
+                if path == sections:
+                    # Sections can't be continued after subsections.
+                    return None
+                path = path[:len(match.group(1)) - 1] + [match.group(2)]
+                continue
+            match = _OPTION.match(line)
+            if match is None or '"' in match.group(2) or "'" in match.group(2):
+                # Quoted values may go on over lines, which look like any
+                # other line.
+                return None
+            if path == sections and match.group(1) == option:
+                value = match.group(2).partition('#')[0].strip()
+                if ',' in value or '%' in value:
+                    return None
+                return value
+    return None
+
+
+def fast_get(argv):
+    """Prints the option for command lines like ``-f FILE get KEY...``,
+    without importing the modules of the other commands and parsing the
+    whole file, if `read_option()` can handle it.
+
+    :returns: whether the option was printed.
+    """
+    if len(argv) < 4 or argv[0] not in ('-f', '--file') or argv[2] != 'get':
+        return False
+    keys = argv[3:]
+    if ('CONFTOOL_SOCKET' in os.environ or
+            any(key.startswith('-') for key in keys)):
+        return False
+    try:
+        value = read_option(argv[1], keys[:-1], keys[-1])
+    except IOError:
+        return False
+    if value is None:
+        return False
+    sys.stdout.write(value + '\n')
+    return True
+
+
+# Skip the imports below for the most frequent use.
+if __name__ == '__main__' and fast_get(sys.argv[1:]):
+    sys.exit()
+
+
+import glob
+import json
+import errno
+import stat
+import fcntl
+import shlex
+import socket
+import signal
 import locale
-locale.setlocale(locale.LC_ALL, '')
-from argparse import ArgumentParser
+import threading
+import traceback
+from tempfile import NamedTemporaryFile
+from contextlib import contextmanager
+from multiprocessing import Pool, cpu_count
+from StringIO import StringIO
+from SocketServer import (StreamRequestHandler, ThreadingMixIn,
+                          UnixStreamServer)
+from argparse import ArgumentParser, FileType
 
-from configobj import ConfigObj, Section
+from configobj import ConfigObj, ConfigObjError, Section
 
 
-def get(args):
-    """Callback for ``get`` command. `args` ist the `argparse` namespace
-    containing all command line options.
+def print_value(config, keys, stream=sys.stdout):
+    """Prints the option or section of `config` which `keys` point to to
+    `stream`.  The whole config is printed, if `keys` is empty.
     """
-    config = value = ConfigObj(args.file, file_error=True)
-    for key in args.keys:
+    value = config
+    for key in keys:
         value = value[key]
     if value is config:
-        config.write(sys.stdout)
+        config.write(stream)
     elif isinstance(value, Section):
-        ConfigObj(value).write(sys.stdout)
+        ConfigObj(value).write(stream)
     else:
-        print value
+        print >> stream, value
 
 
-def set_(args):
-    """Callback for ``set`` command. `args` is the `argparse` namespace
-    containing all the command line options.
+def set_value(config, sections, option, value):
+    """Sets `option` in the section of `config` which the names in
+    `sections` point to.
     """
     # descend to requested section. Create all intermediary sections if
     # necessary
-    config = section = ConfigObj(args.file, create_empty=True)
-    for name in args.sections:
+    section = config
+    for name in sections:
         section = section.setdefault(name, {})
-    section[args.option[0]] = args.value[0]
-    config.write()
+    section[option] = value
 
 
-def delete(args):
-    """Callback for ``del`` command. `args` is the `argparse` namespace
-    containing all the command line options.
+def delete_value(config, keys, keep_empty_sections=False):
+    """Deletes whatever `keys` point to from `config`.  Sections left empty
+    are deleted as well, unless `keep_empty_sections` is true.
     """
     # walk down the line to the last specified key
-    config = value = ConfigObj(args.file)
-    for key in args.keys:
+    keys = list(keys)
+    value = config
+    for key in keys:
         section = value
         value = value[key]
     del section[key]
-    if not args.keep_empty_sections:
+    if not keep_empty_sections:
         # remove the deleted key from the key list
-        args.keys.pop()
+        keys.pop()
         while section is not config:
             # walk up all sections and remove empty ones
             if section:
                 break
             section = section.parent
-            key = args.keys.pop()
+            key = keys.pop()
             del section[key]
-    if args.delete_file_if_empty and not config:
-        # remove the file, if empty
-        os.unlink(args.file)
+
+
+@contextmanager
+def locked(filename):
+    """Holds an exclusive lock for modifying `filename`, waiting for other
+    processes holding it.
+
+    The lock is taken on ``filename.lock``, because `write_config()`
+    replaces the file itself.
+    """
+    with open(os.path.realpath(filename) + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def write_config(config, filename):
+    """Replaces `filename` with `config` atomically, so other processes
+    read either the old or the new contents, even after a crash.
+    """
+    # Replace the target of a symbolic link, not the link.
+    filename = os.path.realpath(filename)
+    directory, basename = os.path.split(filename)
+    try:
+        info = os.stat(filename)
+    except OSError:
+        info = None
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0666 & ~umask
     else:
-        config.write()
+        mode = stat.S_IMODE(info.st_mode)
+    # The temporary file must be on the same file system to be renamed.
+    stream = NamedTemporaryFile(dir=directory, prefix='.' + basename,
+                                delete=False)
+    try:
+        with stream:
+            config.write(stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+        if info is not None:
+            try:
+                os.chown(stream.name, info.st_uid, info.st_gid)
+            except OSError, err:
+                # Only root may give files away.
+                if err.errno != errno.EPERM:
+                    raise
+        os.chmod(stream.name, mode)
+        os.rename(stream.name, filename)
+    except:
+        os.unlink(stream.name)
+        raise
+    # Make the rename itself durable.
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
 
 
-def main():
-    parser = ArgumentParser(
-        description='Command line configuration reader and editor',
-        epilog="""
-Licensed under the terms of the WTFPL, version 2, as published by Sam
-Dovecar. See http://sam.zoy.org/wtfpl/COPYING for details.""")
-    parser.add_argument('-f', '--file', required=True,
-                        help='The config file to work on.')
-    subparsers = parser.add_subparsers()
+def get(args):
+    """Callback for ``get`` command. `args` ist the `argparse` namespace
+    containing all command line options.
+    """
+    print_value(ConfigObj(args.file, file_error=True), args.keys)
+
+
+def set_(args):
+    """Callback for ``set`` command. `args` is the `argparse` namespace
+    containing all the command line options.
+    """
+    with locked(args.file):
+        config = ConfigObj(args.file)
+        set_value(config, args.sections, args.option[0], args.value[0])
+        write_config(config, args.file)
+
+
+def delete(args):
+    """Callback for ``del`` command. `args` is the `argparse` namespace
+    containing all the command line options.
+    """
+    with locked(args.file):
+        config = ConfigObj(args.file)
+        delete_value(config, args.keys, args.keep_empty_sections)
+        if args.delete_file_if_empty and not config:
+            # remove the file, if empty
+            os.unlink(args.file)
+        else:
+            write_config(config, args.file)
+
+
+class BatchError(Exception):
+    """Raised for operations of a batch, which can't be parsed or
+    applied.
+    """
+
+
+class UsageError(Exception):
+    """Raised by `_RaisingParser` for invalid arguments."""
+
+
+class _RaisingParser(ArgumentParser):
+    """Raises `UsageError` instead of exiting on invalid arguments, for
+    arguments which don't come from the command line.
+    """
+
+    def error(self, message):
+        raise UsageError(message)
+
+
+def add_operations(subparsers):
+    """Adds the ``get``, ``set`` and ``del`` commands to `subparsers`."""
     # get a config option
     get_parser = subparsers.add_parser('get', help='Get an option or '
                                        'section.')
@@ -116,13 +303,436 @@ Dovecar. See http://sam.zoy.org/wtfpl/COPYING for details.""")
                             help='Deletes file, if is empty.',
                             action='store_true')
     del_parser.set_defaults(callback=delete)
-    args = parser.parse_args()
+
+
+def read_operations(stream):
+    """Reads the operations of a batch from `stream`.
+
+    Operations are given one per line with the same syntax as on the
+    command line, like ``set section option value``, where empty lines and
+    comments starting with ``#`` are ignored.  Alternatively the whole
+    input is a JSON list of the argument lists of the operations, like
+    ``[["set", "section", "option", "value"]]``.
+
+    :returns: a list of `argparse` namespaces of the operations, with their
+        line or list index as ``number``.
+    :raises BatchError: if any operation is invalid.
+    """
+    parser = _RaisingParser(prog='batch')
+    add_operations(parser.add_subparsers())
+    text = stream.read()
+    if text.lstrip().startswith('['):
+        try:
+            argument_lists = json.loads(text)
+        except ValueError, err:
+            raise BatchError('Invalid JSON: %s' % err)
+        if not all(isinstance(arguments, list)
+                   for arguments in argument_lists):
+            raise BatchError('Operations must be lists of arguments')
+        # ConfigObj works with byte strings.
+        argument_lists = [[unicode(argument).encode('utf-8')
+                           for argument in arguments]
+                          for arguments in argument_lists]
+    else:
+        argument_lists = [shlex.split(line, comments=True)
+                          for line in text.splitlines()]
+    operations = []
+    for number, arguments in enumerate(argument_lists, 1):
+        if not arguments:
+            continue
+        try:
+            operation = parser.parse_args(arguments)
+        except UsageError, err:
+            raise BatchError('Operation %d: %s' % (number, err))
+        operation.number = number
+        operations.append(operation)
+    return operations
+
+
+def apply_operations(config, operations, stream=sys.stdout):
+    """Applies `operations` from `read_operations()` in order to `config`,
+    printing the results of ``get`` operations to `stream`.
+
+    :returns: whether `config` was modified.
+    :raises BatchError: if an operation fails.  `config` may be partially
+        modified then.
+    """
+    modified = False
+    for operation in operations:
+        try:
+            if operation.callback is get:
+                print_value(config, operation.keys, stream)
+            elif operation.callback is set_:
+                set_value(config, operation.sections, operation.option[0],
+                          operation.value[0])
+                modified = True
+            else:
+                delete_value(config, operation.keys,
+                             operation.keep_empty_sections)
+                modified = True
+        except KeyError, err:
+            raise BatchError('Operation %d: No such option or section: %s'
+                             % (operation.number, err))
+    return modified
+
+
+def batch(args):
+    """Callback for ``batch`` command. `args` is the `argparse` namespace
+    containing all the command line options.
+
+    All operations are applied to a single parse of the file, which is
+    written once at the end.  If any operation fails, neither the file is
+    changed nor anything printed.
+    """
+    operations = read_operations(args.operations)
+    output = StringIO()
+    with locked(args.file):
+        config = ConfigObj(args.file)
+        if apply_operations(config, operations, output):
+            if (not config and
+                    any(operation.callback is delete and
+                        operation.delete_file_if_empty
+                        for operation in operations)):
+                if os.path.exists(args.file):
+                    os.unlink(args.file)
+            else:
+                write_config(config, args.file)
+    sys.stdout.write(output.getvalue())
+
+
+def expand_files(pattern):
+    """Returns the files which `pattern` names: the files in a directory,
+    the files matching a glob pattern, or else `pattern` itself.
+    """
+    if os.path.isdir(pattern):
+        # Skip hidden files and the lock files of locked().
+        return sorted(
+            os.path.join(pattern, name) for name in os.listdir(pattern)
+            if not (name.startswith('.') or name.endswith('.lock')) and
+            os.path.isfile(os.path.join(pattern, name)))
+    return sorted(glob.glob(pattern)) or [pattern]
+
+
+def single_file(pattern):
+    """Returns the file which the glob `pattern` names, or else `pattern`
+    itself.
+
+    :raises UsageError: if `pattern` matches several files.
+    """
+    filenames = glob.glob(pattern)
+    if len(filenames) > 1:
+        raise UsageError('%s matches %d files, which only query supports'
+                         % (pattern, len(filenames)))
+    return filenames[0] if filenames else pattern
+
+
+def query_file(filename_and_keys):
+    """Returns the file name and the value of the option or section which
+    the keys point to as text for `query`.  Takes both in a tuple for
+    :meth:`~multiprocessing.pool.Pool.imap`.
+    """
+    (filename, keys) = filename_and_keys
     try:
+        value = read_option(filename, keys[:-1], keys[-1])
+        if value is None:
+            value = ConfigObj(filename, file_error=True)
+            for key in keys:
+                value = value[key]
+    except KeyError:
+        return (filename, '<missing>')
+    except (IOError, ConfigObjError), err:
+        return (filename, '<error: %s>' % err)
+    if isinstance(value, Section):
+        value = '<section: %s>' % ', '.join(value)
+    elif isinstance(value, list):
+        value = ', '.join(value)
+    return (filename, value)
+
+
+def query(args):
+    """Callback for ``query`` command. `args` is the `argparse` namespace
+    containing all the command line options.
+
+    Prints a table of the files and the values in them, parsing the files
+    in parallel.
+    """
+    if not args.files:
+        raise UsageError('no files in %s' % args.file)
+    tasks = [(filename, args.keys) for filename in args.files]
+    jobs = min(args.jobs, len(tasks))
+    if jobs > 1:
+        pool = Pool(jobs)
+        try:
+            results = list(pool.imap(query_file, tasks,
+                                     len(tasks) // (jobs * 4) + 1))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(query_file, tasks)
+    width = max(len(filename) for (filename, _) in results)
+    for filename, value in results:
+        print '%-*s  %s' % (width, filename, value)
+
+
+class ConfigCache(object):
+    """Keeps parsed config files by path, and parses them again when they
+    change.
+    """
+
+    def __init__(self):
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def load(self, filename):
+        """Returns the `ConfigObj` of `filename`.
+
+        :raises IOError: if the file doesn't exist.
+        """
+        try:
+            info = os.stat(filename)
+        except OSError:
+            with self._lock:
+                self._configs.pop(filename, None)
+            return ConfigObj(filename, file_error=True)
+        # write_config() replaces files, so the inode changes even if the
+        # time stamp doesn't.
+        version = (info.st_ino, info.st_size, info.st_mtime)
+        with self._lock:
+            cached = self._configs.get(filename)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        config = ConfigObj(filename, file_error=True)
+        with self._lock:
+            self._configs[filename] = (version, config)
+        return config
+
+
+def error_message(err):
+    """Returns the message to report for an exception of a command."""
+    if isinstance(err, KeyError):
+        return 'No such option or section: %s' % err
+    return str(err)
+
+
+def run_request(request, cache, parser):
+    """Runs a command sent to the server.  `request` maps ``argv`` to the
+    arguments of the command, like on the command line, and ``cwd`` to the
+    directory, which relative file names are relative to.
+
+    ``get`` commands read the config from `cache`, others from the file.
+    `parser` is the `_RaisingParser` from `make_parser()` for the
+    arguments.
+
+    :returns: the output of the command.
+    :raises UsageError: for invalid or unsupported commands.
+    """
+    args = parser.parse_args(
+        [argument.encode('latin-1') for argument in request['argv']])
+    if args.file is None:
+        raise UsageError('argument -f/--file is required')
+    if args.callback not in (get, set_, delete):
+        raise UsageError('only get, set and del are supported by the '
+                         'server')
+    cwd = request.get('cwd', u'/').encode('latin-1')
+    args.file = single_file(os.path.join(cwd, args.file))
+    output = StringIO()
+    if args.callback is get:
+        print_value(cache.load(args.file), args.keys, output)
+    else:
         args.callback(args)
-    except KeyError, err:
-        parser.error('No such option or section: %s' % err)
-    except IOError, err:
-        parser.error(str(err))
+    return output.getvalue()
+
+
+class RequestHandler(StreamRequestHandler):
+    """Answers the requests of a client, as lines of JSON, with a line of
+    JSON, which maps ``output`` to the output and ``error`` to the error
+    message of the command, if it failed.
+
+    Config files and command lines are byte strings in any encoding, so all
+    strings of requests and responses map their bytes to the code points 0
+    to 255, as if they were Latin-1.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                output = run_request(json.loads(line), self.server.cache,
+                                     self.server.parser)
+                response = {'output': output.decode('latin-1')}
+            except (KeyError, IOError, BatchError, UsageError), err:
+                response = {'error': error_message(err).decode('latin-1')}
+            except (ValueError, TypeError), err:
+                response = {'error': 'Invalid request: %s' % err}
+            except Exception, err:
+                # Report the error, but keep serving the connection.
+                traceback.print_exc()
+                response = {'error': 'Internal error: %r' % err}
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class Server(ThreadingMixIn, UnixStreamServer):
+    """Serves requests of `Client` at the Unix socket `path`, with a thread
+    for each connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except socket.error:
+                # Replace the socket of a server, which is gone.
+                os.unlink(path)
+            else:
+                raise IOError('Another server listens on %s' % path)
+            finally:
+                probe.close()
+        UnixStreamServer.__init__(self, path, RequestHandler)
+        self.cache = ConfigCache()
+        # Building the parser takes much longer than parsing.
+        self.parser = make_parser(_RaisingParser)
+
+
+class Client(object):
+    """Sends commands to the server at the Unix socket `path` over a single
+    connection.
+    """
+
+    def __init__(self, path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._stream = self._socket.makefile('rw')
+
+    def run(self, argv, cwd=None):
+        """Runs the command, which the arguments in `argv` describe like on
+        the command line.  Relative file names are relative to `cwd`,
+        which defaults to the current directory.
+
+        The arguments and `cwd` are byte strings, like `sys.argv`.
+
+        :returns: the output and the error message or `None`.
+        """
+        request = {'argv': [argument.decode('latin-1') for argument in argv],
+                   'cwd': (cwd or os.getcwd()).decode('latin-1')}
+        self._stream.write(json.dumps(request) + '\n')
+        self._stream.flush()
+        line = self._stream.readline()
+        if not line:
+            raise IOError('Connection closed by the server')
+        response = json.loads(line)
+        error = response.get('error')
+        return (response.get('output', u'').encode('latin-1'),
+                error and error.encode('latin-1'))
+
+    def close(self):
+        self._stream.close()
+        self._socket.close()
+
+
+def serve(args):
+    """Callback for ``serve`` command. `args` is the `argparse` namespace
+    containing all the command line options.
+    """
+    if not args.socket:
+        raise UsageError('serve needs the socket to listen on, '
+                         'given with -s')
+    server = Server(args.socket)
+    # Clean up when stopped with kill, too.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(server.server_address)
+
+
+def make_parser(parser_class=ArgumentParser):
+    """Returns the parser of the command line."""
+    parser = parser_class(
+        description='Command line configuration reader and editor',
+        epilog="""
+Licensed under the terms of the WTFPL, version 2, as published by Sam
+Dovecar. See http://sam.zoy.org/wtfpl/COPYING for details.""")
+    parser.add_argument('-f', '--file',
+                        help='The config file to work on. This may be a '
+                        'glob pattern matching a single file, or any '
+                        'number of files or a directory for query.')
+    parser.add_argument('-s', '--socket',
+                        default=os.environ.get('CONFTOOL_SOCKET'),
+                        help='Send get, set and del commands to the server '
+                        'listening on the Unix socket SOCKET, or listen on '
+                        'it with serve (default: $CONFTOOL_SOCKET).')
+    subparsers = parser.add_subparsers()
+    add_operations(subparsers)
+    # apply many operations at once
+    batch_parser = subparsers.add_parser('batch', help='Apply get, set and '
+                                         'del operations from a file, all '
+                                         'or none of them.')
+    batch_parser.add_argument('operations', nargs='?', type=FileType('r'),
+                              default=sys.stdin,
+                              help='The file with the operations, one per '
+                              'line or as JSON list of argument lists '
+                              '(default: standard input).')
+    batch_parser.set_defaults(callback=batch)
+    # get an option from many files
+    query_parser = subparsers.add_parser('query', help='Get an option or '
+                                         'section from all files, and print '
+                                         'a table of them.')
+    query_parser.add_argument('keys', nargs='+', metavar='key',
+                              help='The key to get, like for get.')
+    query_parser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+                              help='Parse the files in JOBS processes '
+                              '(default: %(default)s).')
+    query_parser.set_defaults(callback=query)
+    # keep parsed files for other processes
+    serve_parser = subparsers.add_parser('serve', help='Answer get, set and '
+                                         'del commands on the socket given '
+                                         'with -s, keeping parsed files in '
+                                         'memory.')
+    serve_parser.set_defaults(callback=serve)
+    return parser
+
+
+def send(args):
+    """Sends the command line to the server at ``args.socket`` instead of
+    running the command.
+    """
+    client = Client(args.socket)
+    try:
+        (output, error) = client.run(sys.argv[1:])
+    finally:
+        client.close()
+    sys.stdout.write(output)
+    if error:
+        raise UsageError(error)
+
+
+def main():
+    locale.setlocale(locale.LC_ALL, '')
+    parser = make_parser()
+    args = parser.parse_args()
+    if args.callback is serve:
+        callback = serve
+    elif args.file is None:
+        parser.error('argument -f/--file is required')
+    elif args.socket and args.callback in (get, set_, delete):
+        callback = send
+    else:
+        callback = args.callback
+    try:
+        if callback is query:
+            args.files = expand_files(args.file)
+        elif callback is not serve:
+            args.file = single_file(args.file)
+        callback(args)
+    except (KeyError, IOError, BatchError, UsageError), err:
+        parser.error(error_message(err))
 
 
 if __name__ == '__main__':
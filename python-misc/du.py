@@ -5,12 +5,35 @@ from __future__ import division
 
 import os
 import sys
-import math
-from itertools import chain, ifilterfalse, imap
+import csv
+import json
+import base64
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left
+from heapq import merge, heappush, heappushpop
+from argparse import ArgumentParser
+from collections import deque, OrderedDict
+from itertools import imap, izip
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5 needs the backport from http://pypi.python.org/pypi/scandir
+    from scandir import scandir
 
 
-__all__ = ['format_bytesize', 'dir_and_filenames', 'dir_statistic',
-           'print_sizes']
+__all__ = ['format_bytesizes', 'format_bytesize', 'dir_and_filenames',
+           'walk_dir_statistics', 'dir_statistic', 'parallel_dir_statistics',
+           'SizeCache', 'InodeSet', 'TopSizes', 'print_sizes',
+           'print_top_sizes', 'write_dir_statistics', 'TreeWatcher',
+           'watch_sizes', 'SizeDistribution', 'print_size_distribution']
 
 
 # (Short) Names for 1024 based data size units:  Bytes, KibiBytes,
@@ -19,6 +42,81 @@ __all__ = ['format_bytesize', 'dir_and_filenames', 'dir_statistic',
 # TODO: Note down reference to ISO/IEC standard here.
 UNIT_NAMES = ('B', 'KiB', 'MiB', 'GiB', 'TiB')
 
+# Type code of arrays of inode numbers.  Python 2 has no 'Q', but 'L' is 64
+# bit wide on the usual platforms anyway.
+try:
+    INODE_TYPECODE = array('Q').typecode
+except ValueError:
+    INODE_TYPECODE = 'L'
+
+
+#: The templates of `format_bytesizes()` for each unit, by precision.
+_SIZE_TEMPLATES = {}
+
+
+def _size_templates(precision):
+    """Returns the templates of the units for `precision`, building them
+    only the first time.
+    """
+    templates = _SIZE_TEMPLATES.get(precision)
+    if templates is None:
+        templates = ['%d ' + UNIT_NAMES[0].ljust(3)]
+        templates.extend(('%%.%df ' % precision) + name.ljust(3)
+                         for name in UNIT_NAMES[1:])
+        _SIZE_TEMPLATES[precision] = templates
+    return templates
+
+
+def format_bytesizes(sizes, precision=1):
+    """Formats all `sizes` in bytes like `format_bytesize()`.
+
+    The unit of each size is derived from its bit length instead of
+    logarithms.  A NumPy array of sizes is handled as a whole.  NumPy is
+    not imported here, as loading it takes longer than formatting sizes.
+
+    :returns: a list of the formatted sizes.
+    :raises ValueError: if a size is negative.
+    """
+    templates = _size_templates(precision)
+    # Only a caller which imported NumPy can pass an array.
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(sizes, numpy.ndarray):
+        return _format_bytesize_array(numpy, sizes, templates)
+    return [_format_bytesize(size, templates) for size in sizes]
+
+
+def _format_bytesize(size, templates):
+    """Formats `size` with the unit `templates` of a precision."""
+    if size < 0:
+        raise ValueError('negative size (%r)' % size)
+    # Only sizes with more than 3 digits in the integer part need a higher
+    # unit.  As 1000 < 1024 that's one more than the number of complete
+    # multiples of 10 bits, or exactly that many if the remaining integer
+    # part has less than 4 digits.
+    number = int(size)
+    power = max(number.bit_length() - 1, 0) // 10
+    if number >> (10 * power) >= 1000:
+        power += 1
+    if not power:
+        # A size given in bytes does not have a fractional part.
+        return templates[0] % size
+    power = min(power, len(UNIT_NAMES) - 1)
+    return templates[power] % (size / (1 << (10 * power)))
+
+
+def _format_bytesize_array(numpy, sizes, templates):
+    """`format_bytesizes()` for NumPy arrays of the `numpy` module."""
+    if (sizes < 0).any():
+        raise ValueError('negative size (%r)' % sizes[sizes < 0][0])
+    # The number of units above bytes is the number of thresholds of 1000
+    # units which a size reaches.
+    thresholds = [1000 * 1024 ** power for power in range(len(UNIT_NAMES) - 1)]
+    powers = numpy.searchsorted(thresholds, sizes, side='right')
+    numbers = sizes / numpy.power(1024.0, powers)
+    return [templates[power] % (size if not power else number)
+            for (power, size, number) in
+            izip(powers.tolist(), sizes.tolist(), numbers.tolist())]
+
 
 def format_bytesize(size, precision=1):
     """Fomats a `size` in bytes as string with a unit attached.
@@ -32,25 +130,28 @@ def format_bytesize(size, precision=1):
     `precision` parameter.  If the `size` can be formatted as bytes there's
     no fractional part at all.
 
+    To format many sizes at once use `format_bytesizes()`.
+
     :raises ValueError: if `size` is negative.
     """
-    if size < 0:
-        raise ValueError('negative size (%r)' % size)
-
-    # As long as there are more than 3 digits in the integer part of the size
-    # and there is a higher unit, divide `size` by 1024.
-    power = 0
-    while size and math.log10(size) >= 3 and power < len(UNIT_NAMES):
-        power += 1
-        size /= 1024
+    return _format_bytesize(size, _size_templates(precision))
 
-    # A size given in bytes does not have a fractional part.
-    if power == 0:
-        number_format = '%d'
-    else:
-        number_format = '%%.%df' % precision
 
-    return (number_format + ' %-3s') % (size, UNIT_NAMES[power])
+def _dir_and_file_entries(path):
+    """Like `dir_and_filenames()`, but returns the directory entries."""
+    dir_entries = []
+    file_entries = []
+    for entry in scandir(path):
+        # The entry types come from the directory listing itself, so only
+        # regular files need a `stat()` call to get their size.
+        if not entry.is_symlink():
+            if entry.is_dir():
+                dir_entries.append(entry)
+            elif entry.is_file():
+                file_entries.append(entry)
+    dir_entries.sort(key=lambda entry: entry.name)
+    file_entries.sort(key=lambda entry: entry.name)
+    return (dir_entries, file_entries)
 
 
 def dir_and_filenames(path):
@@ -64,68 +165,1301 @@ def dir_and_filenames(path):
     :returns: a tuple of directory names and file names plus file sizes.
     :rtype: ([str], [(str, int)])
     """
-    dirnames = []
-    filenames_and_sizes = []
-    for name in os.listdir(path):
-        fullname = os.path.join(path, name)
-        if not os.path.islink(fullname):
-            if os.path.isdir(fullname):
-                dirnames.append(name)
-            elif os.path.isfile(fullname):
-                filenames_and_sizes.append((name, os.path.getsize(fullname)))
-    dirnames.sort()
-    filenames_and_sizes.sort()
-    return (dirnames, filenames_and_sizes)
-
-
-def dir_statistic(path):
+    (dir_entries, file_entries) = _dir_and_file_entries(path)
+    return ([entry.name for entry in dir_entries],
+            [(entry.name, entry.stat(follow_symlinks=False).st_size)
+             for entry in file_entries])
+
+
+class _SortedChunks(object):
+    """A set of integers in a few sorted arrays.
+
+    New numbers are collected in a small buffer set.  A full buffer is
+    sorted into an array, and arrays are merged with their predecessor as
+    long as that is not larger, so there are only logarithmically many of
+    them.  Each number takes little more than the size of a machine word.
+    """
+
+    BUFFER_SIZE = 4096
+
+    def __init__(self):
+        self.buffer = set()
+        self.chunks = []
+
+    def __len__(self):
+        return len(self.buffer) + sum(len(chunk) for chunk in self.chunks)
+
+    def __contains__(self, number):
+        if number in self.buffer:
+            return True
+        for chunk in self.chunks:
+            index = bisect_left(chunk, number)
+            if index < len(chunk) and chunk[index] == number:
+                return True
+        return False
+
+    def add(self, number):
+        self.buffer.add(number)
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            chunks = self.chunks
+            chunks.append(array(INODE_TYPECODE, sorted(self.buffer)))
+            self.buffer = set()
+            while len(chunks) > 1 and len(chunks[-2]) <= len(chunks[-1]):
+                chunk = chunks.pop()
+                chunks[-1] = array(INODE_TYPECODE, merge(chunks[-1], chunk))
+
+
+class InodeSet(object):
+    """A set of files given by the device and inode numbers of their `stat()`
+    results, to count files with several hard links only once.
+
+    The inode numbers are kept in sorted arrays per device, so the set still
+    fits into memory with tens of millions of files.
+    """
+
+    def __init__(self):
+        self.devices = {}
+
+    def __len__(self):
+        return sum(len(inodes) for inodes in self.devices.values())
+
+    def add(self, stat):
+        """Adds the file with the given `stat` result.
+
+        :returns: ``True`` if the file was not in the set yet.
+        """
+        inodes = self.devices.get(stat.st_dev)
+        if inodes is None:
+            inodes = self.devices[stat.st_dev] = _SortedChunks()
+        elif stat.st_ino in inodes:
+            return False
+        inodes.add(stat.st_ino)
+        return True
+
+
+def _disk_usage(stat):
+    """Returns the number of bytes allocated for the file with the given
+    `stat` result.
+    """
+    try:
+        return stat.st_blocks * 512
+    except AttributeError:
+        # Not all platforms have `st_blocks`.
+        return stat.st_size
+
+
+def _count_size(stat, totals, inodes):
+    """Adds the size and disk usage of the file with the given `stat` result
+    to `totals`, unless it has several hard links and is in the `inodes` set
+    already.
+
+    :returns: ``True`` if the sizes were added, ``False`` otherwise.
+    """
+    if inodes is not None and stat.st_nlink > 1 and not inodes.add(stat):
+        return False
+    totals[2] += stat.st_size
+    totals[3] += _disk_usage(stat)
+    return True
+
+
+def _list_dir(path):
+    """Returns the entries of the directory at `path` as list, or an empty
+    list if it can't be read.  Like `os.walk()` unreadable directories are
+    silently skipped.
+
+    The list is built at once so the directory is not kept open while the
+    walk descends into its subdirectories.
+    """
+    try:
+        return list(scandir(path))
+    except OSError:
+        return []
+
+
+def _count_entry(entry, totals, inodes=None, visit_file=None):
+    """Adds the directory `entry` to the `totals` list of directory count,
+    file count, total size and disk usage.
+
+    Symbolic links are counted but do not contribute to the sizes.  Links to
+    directories are counted as directories, just like `os.walk()` lists them
+    in `dirnames`.  Entries which vanished since the directory was listed are
+    skipped.  Files with several hard links are counted each time, but their
+    sizes are only added the first time if an `InodeSet` is given as
+    `inodes`.
+
+    If given, `visit_file` is called with the entry and its `stat()` result
+    for every file whose sizes were added.
+
+    :returns: ``True`` if `entry` is a directory the walk has to descend
+        into, ``False`` otherwise.
+    """
+    try:
+        if entry.is_symlink():
+            if entry.is_dir():
+                totals[0] += 1
+            else:
+                totals[1] += 1
+            return False
+        stat = entry.stat(follow_symlinks=False)
+    except OSError:
+        return False
+    if entry.is_dir(follow_symlinks=False):
+        # Directories can't have hard links, their link count is the number
+        # of subdirectories.
+        totals[0] += 1
+        totals[2] += stat.st_size
+        totals[3] += _disk_usage(stat)
+        return True
+    totals[1] += 1
+    if _count_size(stat, totals, inodes) and visit_file is not None:
+        visit_file(entry, stat)
+    return False
+
+
+def walk_dir_statistics(path, inodes=None, visit_file=None):
+    """Walks the directory tree under `path` depth first and yields the
+    statistic of every directory as soon as its whole subtree is counted.
+
+    The items are tuples of the directory path and a tuple with directory
+    count, file count and total size of its contents, the same as
+    `dir_statistic()` would return for that directory, plus the disk usage
+    of its contents.  The last item is the one for `path` itself.
+
+    Every entry is stat'ed at most once.  Symbolic links are counted but do
+    not contribute to the sizes and are never followed.  Entries which
+    vanish during the walk are skipped.
+
+    Files with several hard links contribute to the sizes only once per
+    `InodeSet` given as `inodes`.  Sharing a set between walks counts them
+    once across all walks.
+
+    If given, `visit_file` is called with the `DirEntry` and the `stat()`
+    result of every file, except for files whose sizes were not counted
+    because of `inodes`.
+
+    :rtype: iterator of (str, (int, int, int, int))
+    """
+    # Each stack frame holds the path of a directory, an iterator over its
+    # remaining entries and its totals counted so far.  Descending into a
+    # subdirectory pushes a new frame, so the walk does not run into the
+    # recursion limit on deep trees.
+    stack = [(path, iter(_list_dir(path)), [0, 0, 0, 0])]
+    while stack:
+        dirpath, entries, totals = stack[-1]
+        for entry in entries:
+            if _count_entry(entry, totals, inodes, visit_file):
+                stack.append(
+                    (entry.path, iter(_list_dir(entry.path)), [0, 0, 0, 0]))
+                break
+        else:
+            # All entries are done, so the totals are complete and can be
+            # added to the parent directory.
+            stack.pop()
+            if stack:
+                parent_totals = stack[-1][2]
+                for i, value in enumerate(totals):
+                    parent_totals[i] += value
+            yield (dirpath, tuple(totals))
+
+
+def _full_statistic(path, inodes=None, visit_file=None):
+    """Returns the last statistic of `walk_dir_statistics()`, the one for
+    `path` itself.
+    """
+    statistic = (0, 0, 0, 0)
+    for _, statistic in walk_dir_statistics(path, inodes, visit_file):
+        pass
+    return statistic
+
+
+def dir_statistic(path, inodes=None):
     """Counts all files, subdirectories and their total size untder given
     `path` recursivly.
 
-    Symbolic links to files and directories are ignored.
+    Symbolic links to files and directories are not followed and do not
+    contribute to the total size.  Files with several hard links contribute
+    only once per `InodeSet` given as `inodes`.
 
     :returns: a tuple with directory count, file count and total size.
     :rtype: (int, int, int)
     """
-    dir_count = 0
-    file_count = 0
-    total_size = 0
-    for pathname, dirnames, filenames in os.walk(path):
-        dir_count += len(dirnames)
-        file_count += len(filenames)
-        fullnames = (os.path.join(pathname, x) for x in
-                     chain(dirnames, filenames))
-        total_size += sum(imap(os.path.getsize,
-                               ifilterfalse(os.path.islink, fullnames)))
-    return (dir_count, file_count, total_size)
+    return _full_statistic(path, inodes)[:3]
 
 
-def print_sizes(path):
-    """Prints the sizes and names of the directories under `path` (recursivly)
-    and the sizes and names of the files under `path` (non-recursive) plus a
-    grand total of bytes.
+class _WorkStealingWalk(object):
+    """Counts several directory trees at once with a pool of threads.
+
+    Every task is a single directory.  Each worker has its own deque of
+    tasks; the subdirectories it finds are pushed onto it and popped again
+    from the same end, so a worker walks its part of a tree depth first.
+    Idle workers steal from the other end of the other workers' deques, which
+    hands out the directories near the top of a tree and so a large share of
+    the remaining work.  This way a single huge tree is spread over all
+    workers, too.
+    """
+
+    def __init__(self, paths, jobs):
+        self.paths = paths
+        self.queues = [deque() for _ in range(jobs)]
+        # Tasks are the indexes into `paths` of the trees they belong to
+        # plus the directory to count.
+        for index, path in enumerate(paths):
+            self.queues[index % jobs].append((index, path))
+        self.worker_totals = []
+        # The deques and the number of running tasks are protected by the
+        # condition, which idle workers wait on for new tasks.
+        self.condition = threading.Condition()
+        self.running = 0
+
+    def _pop_task(self, worker):
+        """Pops a task from the deque of `worker` or steals one from another
+        worker.  Must be called with the condition held.
+
+        :returns: the task or ``None`` if all deques are empty.
+        """
+        queue = self.queues[worker]
+        if queue:
+            return queue.pop()
+        for queue in self.queues[worker + 1:] + self.queues[:worker]:
+            if queue:
+                return queue.popleft()
+        return None
+
+    def _next_task(self, worker):
+        """Returns the next task for `worker`, or ``None`` if all trees are
+        done.
+        """
+        with self.condition:
+            while True:
+                task = self._pop_task(worker)
+                if task is not None:
+                    self.running += 1
+                    return task
+                if not self.running:
+                    return None
+                # Running tasks may still find new directories.
+                self.condition.wait()
+
+    def _work(self, worker):
+        totals = [[0, 0, 0, 0] for _ in self.paths]
+        self.worker_totals.append(totals)
+        while True:
+            task = self._next_task(worker)
+            if task is None:
+                break
+            index, dirpath = task
+            new_tasks = []
+            try:
+                for entry in _list_dir(dirpath):
+                    if _count_entry(entry, totals[index]):
+                        new_tasks.append((index, entry.path))
+            finally:
+                with self.condition:
+                    self.queues[worker].extend(new_tasks)
+                    self.running -= 1
+                    if new_tasks or not self.running:
+                        self.condition.notify_all()
+
+    def run(self):
+        """Walks all trees and returns their statistics including the disk
+        usage in the order of the paths.
+        """
+        threads = [threading.Thread(target=self._work, args=(worker,))
+                   for worker in range(len(self.queues))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        statistics = []
+        for index in range(len(self.paths)):
+            statistic = [0, 0, 0, 0]
+            for totals in self.worker_totals:
+                for i, value in enumerate(totals[index]):
+                    statistic[i] += value
+            statistics.append(tuple(statistic))
+        return statistics
+
+
+def parallel_dir_statistics(paths, jobs):
+    """Computes `dir_statistic()` for all `paths` with `jobs` threads.
+
+    The directories of all trees are distributed over the threads, so this
+    pays off where the walk waits for the file system rather than the CPU,
+    like on network file systems.  The results are exactly those of the
+    sequential walk.
+
+    :returns: a list of the statistics in the order of `paths`.
+    :rtype: [(int, int, int)]
+    """
+    if not paths:
+        return []
+    return [statistic[:3] for statistic in
+            _WorkStealingWalk(list(paths), jobs).run()]
+
+
+class _CacheFrame(object):
+    """A directory on the stack of `SizeCache._walk()`."""
+
+    __slots__ = ('path', 'stat', 'row', 'totals', 'children')
+
+    def __init__(self, path, stat, row, totals, children):
+        self.path = path
+        self.stat = stat
+        # The cached row of the directory, if any.
+        self.row = row
+        # The totals of the directory without its subdirectories.  Their
+        # entries and contents are added once they are done.
+        self.totals = totals
+        # An iterator over the paths and stat results of the subdirectories.
+        # The stat result is ``None`` if the directory wasn't listed.
+        self.children = children
+
+
+class SizeCache(object):
+    """A persistent cache of directory statistics in a SQLite database.
+
+    For every directory the cache stores its mtime and ctime and its
+    statistic including the disk usage.  A directory whose times did not change
+    since it was cached still has the same entries, so it isn't listed
+    again, only its subdirectories are checked.  A subtree without changes
+    costs a single `stat()` per directory then, no matter how many files it
+    contains.
+
+    Changes which don't touch the times of any directory, like a file
+    growing in place or the target of a symbolic link turning from a
+    directory into a file, are not noticed.
     """
-    grand_total = 0
-    (dirnames, filenames_and_sizes) = dir_and_filenames(path)
-    print '    size       type   dirs/files name'
+
+    #: The version of the database layout.  A cache with another version is
+    #: dropped.
+    SCHEMA_VERSION = 2
+
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        # Paths are byte strings in any encoding, which are stored and
+        # compared as they are.
+        self.connection.text_factory = str
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            with self.connection:
+                self.connection.executescript("""
+                    DROP TABLE IF EXISTS directories;
+                    CREATE TABLE directories (
+                        path TEXT PRIMARY KEY, parent TEXT,
+                        mtime REAL, ctime REAL, size INTEGER,
+                        usage INTEGER, dir_count INTEGER,
+                        file_count INTEGER, total_size INTEGER,
+                        disk_usage INTEGER);
+                    CREATE INDEX directories_parent ON directories (parent);
+                    PRAGMA user_version = %d;
+                    """ % self.SCHEMA_VERSION)
+        #: Number of directories listed and counted since the cache was
+        #: opened.
+        self.rescanned = 0
+        #: Number of directories taken from the cache since it was opened.
+        self.reused = 0
+
+    def close(self):
+        self.connection.close()
+
+    def _cached_children(self, path):
+        return self.connection.execute(
+            'SELECT path, size, usage, dir_count, file_count, total_size, '
+            'disk_usage FROM directories WHERE parent = ?', (path,)).fetchall()
+
+    def _forget(self, path):
+        """Removes `path` and everything below it from the cache."""
+        # All paths below `path` sort between "path/" and "path0", because
+        # "0" follows "/" in ASCII.  The root directory ends with "/" already.
+        prefix = path.rstrip(os.sep) + os.sep
+        self.connection.execute(
+            'DELETE FROM directories WHERE path = ? OR '
+            '(path > ? AND path < ?)', (path, prefix, prefix[:-1] + '0'))
+
+    def _open(self, path, stat):
+        """Creates the stack frame for the directory at `path` with the
+        given `stat` result.
+        """
+        row = self.connection.execute(
+            'SELECT mtime, ctime, dir_count, file_count, total_size, '
+            'disk_usage FROM directories WHERE path = ?', (path,)).fetchone()
+        if row and row[:2] == (stat.st_mtime, stat.st_ctime):
+            # The entries did not change, so the totals of this directory
+            # alone are the cached totals minus those of the subdirectories.
+            self.reused += 1
+            children = self._cached_children(path)
+            totals = [row[2] - len(children), row[3], row[4], row[5]]
+            for child in children:
+                (_, size, usage, dir_count, file_count, total_size,
+                 disk_usage) = child
+                totals[0] -= dir_count
+                totals[1] -= file_count
+                totals[2] -= size + total_size
+                totals[3] -= usage + disk_usage
+            return _CacheFrame(path, stat, row, totals,
+                               iter([(child[0], None) for child in children]))
+
+        self.rescanned += 1
+        totals = [0, 0, 0, 0]
+        subdirs = []
+        for entry in _list_dir(path):
+            if _count_entry(entry, totals):
+                # Subdirectories are added when they are done, with their
+                # current size.  `stat()` results are cached by the entry.
+                subdir_stat = entry.stat(follow_symlinks=False)
+                totals[0] -= 1
+                totals[2] -= subdir_stat.st_size
+                totals[3] -= _disk_usage(subdir_stat)
+                subdirs.append((entry.path, subdir_stat))
+        if row:
+            current = set(subdir for (subdir, _) in subdirs)
+            for child in self._cached_children(path):
+                if child[0] not in current:
+                    self._forget(child[0])
+        return _CacheFrame(path, stat, row, totals, iter(subdirs))
+
+    def _walk(self, path):
+        stack = [self._open(path, os.lstat(path))]
+        while stack:
+            frame = stack[-1]
+            for (subdir, stat) in frame.children:
+                if stat is None:
+                    try:
+                        stat = os.lstat(subdir)
+                    except OSError:
+                        # Vanished after the parent was cached.
+                        self._forget(subdir)
+                        continue
+                stack.append(self._open(subdir, stat))
+                break
+            else:
+                stack.pop()
+                statistic = tuple(frame.totals)
+                times = (frame.stat.st_mtime, frame.stat.st_ctime)
+                if frame.row != times + statistic:
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO directories VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (frame.path, os.path.dirname(frame.path))
+                        + times + (frame.stat.st_size,
+                                   _disk_usage(frame.stat)) + statistic)
+                if stack:
+                    parent_totals = stack[-1].totals
+                    parent_totals[0] += 1 + statistic[0]
+                    parent_totals[1] += statistic[1]
+                    parent_totals[2] += frame.stat.st_size + statistic[2]
+                    parent_totals[3] += _disk_usage(frame.stat) + statistic[3]
+        return statistic
+
+    def full_statistic(self, path):
+        """Like `dir_statistic()` plus the disk usage, but only lists and
+        counts the directories which changed since they were cached, and
+        updates the cache.
+
+        :rtype: (int, int, int, int)
+        """
+        with self.connection:
+            return self._walk(os.path.abspath(path))
+
+    def dir_statistic(self, path):
+        """Like `dir_statistic()`, but only lists and counts the directories
+        which changed since they were cached, and updates the cache.
+        """
+        return self.full_statistic(path)[:3]
+
+
+class TopSizes(object):
+    """Keeps the largest files and directories of a walk.
+
+    Only the `count` largest ones are kept in a heap each, so the memory
+    needed doesn't depend on the size of the tree.  With `disk_usage` the
+    files and directories are ranked by their disk usage instead of their
+    size.
+    """
+
+    def __init__(self, count, disk_usage=False):
+        self.count = count
+        self.disk_usage = disk_usage
+        # Heaps of sizes and paths, with the smallest size first.
+        self.files = []
+        self.directories = []
+
+    def _add(self, heap, size, path):
+        if len(heap) < self.count:
+            heappush(heap, (size, path))
+        elif size > heap[0][0]:
+            heappushpop(heap, (size, path))
+
+    def add_file(self, entry, stat):
+        """Adds a file given by its `DirEntry` and `stat()` result.  Fits
+        the `visit_file` argument of `walk_dir_statistics()`.
+        """
+        if self.disk_usage:
+            size = _disk_usage(stat)
+        else:
+            size = stat.st_size
+        self._add(self.files, size, entry.path)
+
+    def add_directory(self, path, statistic):
+        """Adds a directory given by its path and its statistic as yielded
+        by `walk_dir_statistics()`.
+        """
+        self._add(self.directories, statistic[3 if self.disk_usage else 2],
+                  path)
+
+    def largest_files(self):
+        """Returns the sizes and paths of the largest files, largest first.
+
+        :rtype: [(int, str)]
+        """
+        return sorted(self.files, reverse=True)
+
+    def largest_directories(self):
+        """Returns the sizes and paths of the largest directories, largest
+        first.
+
+        :rtype: [(int, str)]
+        """
+        return sorted(self.directories, reverse=True)
+
+
+def print_top_sizes(path, count, inodes=None, disk_usage=False,
+                    distribution=None):
+    """Prints the sizes and paths of the `count` largest directories and the
+    `count` largest files anywhere under `path`.
+
+    If an `InodeSet` is given as `inodes`, files with several hard links are
+    only counted the first time.  With `disk_usage` directories and files
+    are ranked by their disk usage.  The files are added to the
+    `SizeDistribution` given as `distribution`, too.
+    """
+    top = TopSizes(count, disk_usage)
+    visit_file = top.add_file
+    if distribution is not None:
+        def visit_file(entry, stat):
+            top.add_file(entry, stat)
+            distribution.add_file(entry, stat)
+    walk = walk_dir_statistics(path, inodes, visit_file)
+    for dirpath, statistic in walk:
+        if dirpath != path:
+            top.add_directory(dirpath, statistic)
+
+    if disk_usage:
+        print '   usage       largest directories'
+    else:
+        print '    size       largest directories'
+    print ':' * 70
+    directories = top.largest_directories()
+    sizes = format_bytesizes([size for (size, _) in directories])
+    for formatted_size, (_, dirpath) in izip(sizes, directories):
+        print '%12s   %s' % (formatted_size, dirpath)
+    print
+    if disk_usage:
+        print '   usage       largest files'
+    else:
+        print '    size       largest files'
+    print ':' * 70
+    files = top.largest_files()
+    sizes = format_bytesizes([size for (size, _) in files])
+    for formatted_size, (_, filepath) in izip(sizes, files):
+        print '%12s   %s' % (formatted_size, filepath)
+
+
+class SizeDistribution(object):
+    """Counts files and their sizes by size and by extension.
+
+    The sizes are put into buckets of powers of two: bucket 0 holds empty
+    files, bucket ``n`` the files with at least ``2 ** (n - 1)`` and less
+    than ``2 ** n`` bytes.  Extensions are compared case-insensitively.
+    """
+
+    #: The number of buckets, enough for 64 bit sizes.
+    BUCKETS = 65
+
+    def __init__(self):
+        self.bucket_counts = [0] * self.BUCKETS
+        self.bucket_sizes = [0] * self.BUCKETS
+        # Maps extensions, including the dot, to their file count and size.
+        self.extensions = {}
+
+    def add_file(self, entry, stat):
+        """Adds a file given by its `DirEntry` and `stat()` result.  Fits
+        the `visit_file` argument of `walk_dir_statistics()`.
+        """
+        size = stat.st_size
+        bucket = min(size.bit_length(), self.BUCKETS - 1)
+        self.bucket_counts[bucket] += 1
+        self.bucket_sizes[bucket] += size
+        extension = os.path.splitext(entry.name)[1].lower()
+        totals = self.extensions.get(extension)
+        if totals is None:
+            totals = self.extensions[extension] = [0, 0]
+        totals[0] += 1
+        totals[1] += size
+
+    def buckets(self):
+        """Returns the non-empty buckets, smallest sizes first.
+
+        :returns: the smallest and largest size which fall into the bucket,
+            the number of files and their total size.
+        :rtype: [(int, int, int, int)]
+        """
+        return [(1 << bucket >> 1, (1 << bucket) - 1, count, size)
+                for (bucket, (count, size)) in
+                enumerate(izip(self.bucket_counts, self.bucket_sizes))
+                if count]
+
+    def extension_totals(self):
+        """Returns the extensions with their file count and total size,
+        largest total size first.
+
+        :rtype: [(str, int, int)]
+        """
+        return sorted(((extension, count, size) for
+                       (extension, (count, size)) in
+                       self.extensions.iteritems()),
+                      key=lambda item: (-item[2], item[0]))
+
+    def records(self):
+        """Returns the buckets and extensions as records for structured
+        output.
+        """
+        records = []
+        for (min_size, max_size, count, size) in self.buckets():
+            records.append({'type': 'size_bucket', 'min_size': min_size,
+                            'max_size': max_size, 'file_count': count,
+                            'total_size': size})
+        for (extension, count, size) in self.extension_totals():
+            records.append({'type': 'extension', 'extension': extension,
+                            'file_count': count, 'total_size': size})
+        return records
+
+
+def print_size_distribution(distribution):
+    """Prints the buckets and extensions of a `SizeDistribution`."""
+    print '    size      files   file sizes'
+    print ':' * 70
+    buckets = distribution.buckets()
+    # The total, the smallest and the bound of each bucket in one go.
+    sizes = iter(format_bytesizes(
+        size for bucket in buckets
+        for size in (bucket[3], bucket[0], bucket[1] + 1)))
+    for (_, max_size, count, _) in buckets:
+        (size, min_size, bound) = (next(sizes), next(sizes), next(sizes))
+        if max_size:
+            range_ = '%s to < %s' % (min_size.strip(), bound.strip())
+        else:
+            range_ = 'empty'
+        print '%12s %8d   %s' % (size, count, range_)
+    print
+    print '    size      files   extension'
+    print ':' * 70
+    extensions = distribution.extension_totals()
+    sizes = format_bytesizes([size for (_, _, size) in extensions])
+    for size, (extension, count, _) in izip(sizes, extensions):
+        print '%12s %8d   %s' % (size, count, extension or '(none)')
+
+
+def _text_path(path):
+    """Returns `path` as unicode string for JSON, and whether it is exact.
+
+    Byte strings are decoded as UTF-8, or else in the file system encoding,
+    which is just ASCII in the C locale.  Bytes which neither can decode are
+    replaced.
+    """
+    if not isinstance(path, bytes):
+        return (path, True)
+    for encoding in ('utf-8', sys.getfilesystemencoding()):
+        try:
+            return (path.decode(encoding), True)
+        except (UnicodeDecodeError, LookupError, TypeError):
+            pass
+    return (path.decode('utf-8', 'replace'), False)
+
+
+class _NDJSONWriter(object):
+    """Writes records as one JSON object per line.
+
+    Paths which can't be decoded exactly are given in ``path_base64`` as
+    well, so consumers can still find them.
+    """
+
+    def __init__(self, stream, fieldnames):
+        self.stream = stream
+        self.fieldnames = fieldnames
+
+    def write(self, record):
+        path = record.get('path')
+        record = OrderedDict((name, record[name]) for name in self.fieldnames
+                             if name in record)
+        if path is not None:
+            (record['path'], exact) = _text_path(path)
+            if not exact:
+                record['path_base64'] = base64.b64encode(path)
+        self.stream.write(json.dumps(record) + '\n')
+
+
+class _CSVWriter(object):
+    """Writes records as CSV rows below a header line."""
+
+    def __init__(self, stream, fieldnames):
+        self.writer = csv.DictWriter(stream, fieldnames)
+        self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+
+#: Writers of structured output by format name.
+RECORD_WRITERS = {'ndjson': _NDJSONWriter, 'csv': _CSVWriter}
+
+#: The fields of records in structured output.
+RECORD_FIELDS = ('type', 'path', 'dir_count', 'file_count', 'total_size',
+                 'disk_usage')
+
+#: The additional fields of the records of a `SizeDistribution`.
+DISTRIBUTION_FIELDS = ('min_size', 'max_size', 'extension')
+
+
+def write_dir_statistics(path, stream, output_format, inodes=None,
+                         distribution=None):
+    """Writes the statistic of every directory under `path` and of `path`
+    itself to `stream`, in the structured `output_format` 'ndjson' or
+    'csv'.
+
+    Each record is written as soon as the directory is done, deepest
+    directories first and `path` last, so consumers don't need to wait for
+    the whole walk.  Sizes are in bytes.  If an `InodeSet` is given as
+    `inodes`, files with several hard links are only counted the first time.
+
+    If a `SizeDistribution` is given as `distribution`, all files are added
+    to it and its records are written after those of the directories.
+    """
+    if distribution is None:
+        writer = RECORD_WRITERS[output_format](stream, RECORD_FIELDS)
+        visit_file = None
+    else:
+        writer = RECORD_WRITERS[output_format](
+            stream, RECORD_FIELDS + DISTRIBUTION_FIELDS)
+        visit_file = distribution.add_file
+    for dirpath, statistic in walk_dir_statistics(path, inodes, visit_file):
+        (dir_count, file_count, total_size, disk_usage) = statistic
+        writer.write({'type': 'directory', 'path': dirpath,
+                      'dir_count': dir_count, 'file_count': file_count,
+                      'total_size': total_size, 'disk_usage': disk_usage})
+    if distribution is not None:
+        for record in distribution.records():
+            writer.write(record)
+
+
+def _print_size_table(directories, files, disk_usage=False, lazy=False):
+    """Prints the table of `print_sizes()`.
+
+    `directories` is an iterable of directory names and statistics as
+    yielded by `walk_dir_statistics()`, `files` an iterable of file names,
+    sizes and disk usages.  The sizes are formatted a column at a time,
+    except for `lazy` directories, which are printed one by one as soon as
+    they are counted.
+    """
+    grand_total = [0, 0]
+    if disk_usage:
+        print '    size         usage      type   dirs/files name'
+        size_format = '%12s %12s'
+    else:
+        print '    size       type   dirs/files name'
+        size_format = '%12s'
     print ':' * 70
 
+    def format_sizes(sizes, usages):
+        """Formats the size columns of the rows with `sizes` and `usages`,
+        adding them to the grand total.
+        """
+        grand_total[0] += sum(sizes)
+        grand_total[1] += sum(usages)
+        if disk_usage:
+            return [size_format % pair for pair in
+                    izip(format_bytesizes(sizes), format_bytesizes(usages))]
+        return [size_format % size for size in format_bytesizes(sizes)]
+
     # Print directories.
-    for dirname in dirnames:
-        fullname = os.path.join(path, dirname)
-        (dir_count, file_count, total_size) = dir_statistic(fullname)
-        grand_total += total_size
-        print '%12s   DIR   %5d/%-5d %s' % (format_bytesize(total_size),
-                                            dir_count, file_count, dirname)
+    if lazy:
+        chunks = ([item] for item in directories)
+    else:
+        chunks = [list(directories)]
+    for chunk in chunks:
+        sizes = format_sizes([statistic[2] for (_, statistic) in chunk],
+                             [statistic[3] for (_, statistic) in chunk])
+        for formatted_size, (name, statistic) in izip(sizes, chunk):
+            (dir_count, file_count, _, _) = statistic
+            print '%s   DIR   %5d/%-5d %s' % (formatted_size, dir_count,
+                                              file_count, name)
 
     # Print files.
-    for (name, size) in filenames_and_sizes:
-        grand_total += size
-        print '%12s   file              %s' % (format_bytesize(size), name)
+    files = list(files)
+    sizes = format_sizes([size for (_, size, _) in files],
+                         [usage for (_, _, usage) in files])
+    for formatted_size, (name, _, _) in izip(sizes, files):
+        print '%s   file              %s' % (formatted_size, name)
 
     # And the grand total.
-    print '------------------\n%12s total' % format_bytesize(grand_total)
+    (total_size, total_usage) = grand_total
+    print '------------------\n%s total' % format_sizes([total_size],
+                                                      [total_usage])[0]
+
+
+def print_sizes(path, jobs=1, cache=None, inodes=None, disk_usage=False,
+                distribution=None):
+    """Prints the sizes and names of the directories under `path` (recursivly)
+    and the sizes and names of the files under `path` (non-recursive) plus a
+    grand total of bytes.
+
+    With more than one of `jobs` the directories are counted in parallel.
+    If a `SizeCache` is given as `cache`, it is used to count the
+    directories instead.  If an `InodeSet` is given as `inodes`, files with
+    several hard links are only counted the first time.  With `disk_usage`
+    the disk usage is printed next to each size.  All files are added to
+    the `SizeDistribution` given as `distribution`.
+
+    :raises ValueError: if `inodes` or `distribution` is given together with
+        `jobs` or `cache`.
+    """
+    if ((inodes is not None or distribution is not None) and
+            (jobs > 1 or cache is not None)):
+        raise ValueError('inodes and distributions can only be counted by a '
+                         'sequential walk')
+    visit_file = distribution and distribution.add_file
+    (dir_entries, file_entries) = _dir_and_file_entries(path)
+    fullnames = [entry.path for entry in dir_entries]
+    if cache is not None:
+        statistics = imap(cache.full_statistic, fullnames)
+    elif jobs > 1:
+        statistics = _WorkStealingWalk(fullnames, jobs).run()
+    else:
+        # Walk lazily so each line is printed as soon as it's known.
+        statistics = (_full_statistic(fullname, inodes, visit_file)
+                      for fullname in fullnames)
+
+    def file_sizes():
+        for entry in file_entries:
+            totals = [0, 0, 0, 0]
+            stat = entry.stat(follow_symlinks=False)
+            if _count_size(stat, totals, inodes) and visit_file:
+                visit_file(entry, stat)
+            yield (entry.name, totals[2], totals[3])
+
+    _print_size_table(
+        izip((entry.name for entry in dir_entries), statistics),
+        file_sizes(), disk_usage, cache is None and jobs <= 1)
+
+
+# inotify(7) constants from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_CLOEXEC = 0o2000000
+
+#: The events which may change the sizes in a watched directory.
+WATCH_EVENTS = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR |
+                IN_DONT_FOLLOW)
+
+# Header of each event read from an inotify descriptor: watch descriptor,
+# mask, cookie and length of the name following the header.
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """A minimal binding of inotify(7) with :mod:`ctypes`.
+
+    :raises OSError: if inotify is not available.
+    """
+
+    def __init__(self):
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                    use_errno=True)
+            init = self.libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = init(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, path, mask):
+        """Watches the events in `mask` at `path`.
+
+        :returns: the watch descriptor.
+        :raises OSError: for instance with ``ENOSPC`` if the limit of watches
+            is reached.
+        """
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._raise()
+        return wd
+
+    def rm_watch(self, wd):
+        # The kernel removes watches of deleted directories by itself.
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Reads the pending events.  Blocks if there are none.
+
+        :returns: a list of watch descriptors and masks.
+        :rtype: [(int, int)]
+        """
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            (wd, mask, _, length) = _INOTIFY_EVENT.unpack_from(data, offset)
+            events.append((wd, mask))
+            offset += _INOTIFY_EVENT.size + length
+        return events
+
+
+class _WatchedDir(object):
+    """A directory in the tree of a `TreeWatcher`."""
+
+    __slots__ = ('parent', 'own', 'totals', 'subdirs', 'wd')
+
+    def __init__(self, parent, own, subdirs):
+        self.parent = parent
+        # The totals of the entries of this directory alone, and including
+        # all subdirectories.
+        self.own = own
+        self.totals = list(own)
+        self.subdirs = subdirs
+        # The inotify watch descriptor, or ``None`` if the directory is
+        # polled.
+        self.wd = None
+
+
+class TreeWatcher(object):
+    """Keeps the statistics of all directories under `path` up to date.
+
+    After an initial walk all directories are watched with inotify.  Changed
+    directories are collected and only their entries are counted again by
+    `update()`, the differences are added to their parent directories.
+
+    Directories which can't be watched, because inotify is not available or
+    the limit of watches is reached, are polled instead: each `update()`
+    counts their entries again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dirs = {}
+        self.wds = {}
+        # Directories with changes since the last update, directories whose
+        # watch was removed by the kernel and polled directories.
+        self.dirty = set()
+        self.reset = set()
+        self.polled = set()
+        # The names, sizes and disk usages of the files in `path` itself.
+        self.files = []
+        try:
+            self.inotify = Inotify()
+        except OSError:
+            self.inotify = None
+        self._add_subtree(path, None)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+    def fileno(self):
+        """Returns the inotify descriptor to wait for changes, or ``None`` if
+        inotify is not available.
+        """
+        return self.inotify and self.inotify.fileno()
+
+    def _count_dir(self, path):
+        """Counts the entries of the directory at `path` alone.
+
+        :returns: the totals and the set of subdirectories.
+        """
+        own = [0, 0, 0, 0]
+        subdirs = set()
+        if path == self.path:
+            del self.files[:]
+
+            def visit_file(entry, stat):
+                if entry.is_file(follow_symlinks=False):
+                    self.files.append(
+                        (entry.name, stat.st_size, _disk_usage(stat)))
+        else:
+            visit_file = None
+        for entry in _list_dir(path):
+            if _count_entry(entry, own, visit_file=visit_file):
+                subdirs.add(entry.path)
+        if path == self.path:
+            self.files.sort()
+        return (own, subdirs)
+
+    def _watch(self, path, directory):
+        if self.inotify is not None:
+            try:
+                directory.wd = self.inotify.add_watch(path, WATCH_EVENTS)
+                self.wds[directory.wd] = path
+                self.polled.discard(path)
+                return
+            except OSError:
+                # Most likely out of watches, see
+                # /proc/sys/fs/inotify/max_user_watches.
+                pass
+        self.polled.add(path)
+
+    def _add_to_parents(self, path, totals, sign):
+        """Adds `totals` times `sign` to all directories above `path`."""
+        parent = self.dirs[path].parent
+        while parent is not None:
+            directory = self.dirs[parent]
+            for i, value in enumerate(totals):
+                directory.totals[i] += sign * value
+            parent = directory.parent
+
+    def _add_subtree(self, path, parent):
+        """Counts and watches the directory `path` below `parent` and all its
+        subdirectories.
+        """
+        added = []
+        pending = [(path, parent)]
+        while pending:
+            (dirpath, dirparent) = pending.pop()
+            (own, subdirs) = self._count_dir(dirpath)
+            directory = _WatchedDir(dirparent, own, subdirs)
+            self.dirs[dirpath] = directory
+            self._watch(dirpath, directory)
+            added.append(directory)
+            pending.extend((subdir, dirpath) for subdir in subdirs)
+        # Sum up the totals bottom up, the parents of the new subtree only
+        # get the totals of its top.
+        for directory in reversed(added[1:]):
+            parent_totals = self.dirs[directory.parent].totals
+            for i, value in enumerate(directory.totals):
+                parent_totals[i] += value
+        if parent is not None:
+            self.dirs[parent].subdirs.add(path)
+            self._add_to_parents(path, added[0].totals, 1)
+
+    def _remove_subtree(self, path):
+        """Forgets the directory `path` and all its subdirectories."""
+        directory = self.dirs.get(path)
+        if directory is None:
+            return
+        self._add_to_parents(path, directory.totals, -1)
+        self.dirs[directory.parent].subdirs.discard(path)
+        pending = [path]
+        while pending:
+            dirpath = pending.pop()
+            directory = self.dirs.pop(dirpath)
+            self.polled.discard(dirpath)
+            if directory.wd is not None:
+                del self.wds[directory.wd]
+                self.inotify.rm_watch(directory.wd)
+            pending.extend(directory.subdirs)
+
+    def read_events(self):
+        """Reads the pending inotify events and remembers the changed
+        directories.  Blocks if there are none.
+        """
+        for (wd, mask) in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so anything may have changed.
+                self.dirty.update(self.dirs)
+                continue
+            path = self.wds.get(wd)
+            if path is None:
+                continue
+            if mask & IN_IGNORED:
+                # The directory was deleted, possibly replaced by a new one,
+                # so forget it and let its parent find out.
+                del self.wds[wd]
+                self.dirs[path].wd = None
+                if path != self.path:
+                    self.reset.add(path)
+                    self.dirty.add(self.dirs[path].parent)
+            else:
+                self.dirty.add(path)
+
+    def update(self):
+        """Counts the entries of changed and polled directories again and
+        updates the statistics.
+        """
+        changed = self.dirty | self.polled
+        self.dirty = set()
+        removed = set()
+        added = []
+        # Count all changed directories first and remove and add subtrees
+        # afterwards, because a subdirectory moved from one changed
+        # directory to another keeps its watch descriptor.
+        for path in changed:
+            directory = self.dirs.get(path)
+            if directory is None:
+                continue
+            (own, subdirs) = self._count_dir(path)
+            delta = [new - old for (new, old) in zip(own, directory.own)]
+            for i, value in enumerate(delta):
+                directory.totals[i] += value
+            self._add_to_parents(path, delta, 1)
+            directory.own = own
+            removed.update(directory.subdirs - subdirs)
+            removed.update(directory.subdirs & self.reset)
+            added.extend((subdir, path) for subdir in subdirs
+                         if subdir not in directory.subdirs or
+                         subdir in self.reset)
+            if path in self.polled:
+                # Maybe there are watches available again.
+                self._watch(path, directory)
+        self.reset -= removed
+        for path in removed:
+            self._remove_subtree(path)
+        for (path, parent) in added:
+            if parent in self.dirs:
+                self._add_subtree(path, parent)
+
+    def statistic(self, path):
+        """Returns the current statistic of the directory at `path`
+        including the disk usage.
+        """
+        return tuple(self.dirs[path].totals)
+
+    def print_sizes(self, disk_usage=False):
+        """Prints the current sizes like `print_sizes()`."""
+        subdirs = sorted(self.dirs[self.path].subdirs)
+        _print_size_table(
+            ((os.path.basename(subdir), self.statistic(subdir))
+             for subdir in subdirs),
+            self.files, disk_usage)
+
+
+def watch_sizes(path, interval, disk_usage=False):
+    """Prints the sizes like `print_sizes()` every `interval` seconds,
+    keeping them up to date with a `TreeWatcher`.  Runs forever.
+    """
+    watcher = TreeWatcher(path)
+    try:
+        while True:
+            watcher.update()
+            watcher.print_sizes(disk_usage)
+            print
+            sys.stdout.flush()
+            deadline = time.time() + interval
+            timeout = interval
+            while timeout > 0:
+                if watcher.fileno() is None:
+                    time.sleep(timeout)
+                elif select.select([watcher], [], [], timeout)[0]:
+                    watcher.read_events()
+                timeout = deadline - time.time()
+    finally:
+        watcher.close()
+
+
+def main():
+    parser = ArgumentParser(
+        description='Show the sizes of the directories and files in a '
+        'directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Count the directories with JOBS threads '
+                        '(default: %(default)s).')
+    parser.add_argument('-c', '--cache', metavar='PATH',
+                        help='Keep the sizes of all directories in the '
+                        'database at PATH and only count the directories '
+                        'which changed since the last run.')
+    parser.add_argument('--count-links-once', action='store_true',
+                        help='Count the size of files with several hard '
+                        'links only once.')
+    parser.add_argument('-u', '--disk-usage', action='store_true',
+                        help='Show the disk usage next to the size.')
+    parser.add_argument('-t', '--top', type=int, metavar='N',
+                        help='Show the N largest directories and files at '
+                        'any depth instead.')
+    parser.add_argument('-f', '--format', default='text',
+                        choices=['text'] + sorted(RECORD_WRITERS),
+                        help='Write the statistics of all directories at '
+                        'any depth as they are counted in the given format '
+                        'instead of the table (default: %(default)s).')
+    parser.add_argument('-s', '--distribution', action='store_true',
+                        help='Also show the number and size of files by '
+                        'size and by extension.')
+    parser.add_argument('-w', '--watch', type=float, metavar='SECONDS',
+                        help='Watch the directory for changes and show the '
+                        'sizes again every SECONDS.')
+    parser.add_argument('path', help='The directory to show.')
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.cache and args.jobs > 1:
+        parser.error('--cache can not be used with --jobs')
+    if args.count_links_once and (args.cache or args.jobs > 1):
+        parser.error('--count-links-once can not be used with --cache or '
+                     '--jobs')
+    if args.top is not None and (args.cache or args.jobs > 1):
+        parser.error('--top can not be used with --cache or --jobs')
+    if args.top is not None and args.top < 1:
+        parser.error('--top must be at least 1')
+    if args.format != 'text' and (args.cache or args.jobs > 1 or
+                                  args.top is not None):
+        parser.error('--format can not be used with --cache, --jobs or '
+                     '--top')
+    if args.distribution and (args.cache or args.jobs > 1):
+        parser.error('--distribution can not be used with --cache or --jobs')
+    if args.watch is not None and (
+            args.cache or args.jobs > 1 or args.count_links_once or
+            args.top is not None or args.format != 'text' or
+            args.distribution):
+        parser.error('--watch can only be used with --disk-usage')
+    if args.watch is not None and args.watch <= 0:
+        parser.error('--watch must be positive')
+    inodes = InodeSet() if args.count_links_once else None
+    distribution = SizeDistribution() if args.distribution else None
+    if args.watch is not None:
+        try:
+            watch_sizes(args.path, args.watch, args.disk_usage)
+        except KeyboardInterrupt:
+            pass
+    elif args.format != 'text':
+        write_dir_statistics(args.path, sys.stdout, args.format, inodes,
+                             distribution)
+    elif args.top is not None:
+        print_top_sizes(args.path, args.top, inodes, args.disk_usage,
+                        distribution)
+    elif args.cache:
+        cache = SizeCache(args.cache)
+        try:
+            print_sizes(args.path, cache=cache, disk_usage=args.disk_usage)
+        finally:
+            cache.close()
+        sys.stderr.write('%d directories rescanned, %d reused from cache\n'
+                         % (cache.rescanned, cache.reused))
+    else:
+        print_sizes(args.path, args.jobs, inodes=inodes,
+                    disk_usage=args.disk_usage, distribution=distribution)
+    if distribution is not None and args.format == 'text':
+        print
+        print_size_distribution(distribution)
 
 
 if __name__ == '__main__':
-    print_sizes(sys.argv[1])
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    du_benchmark
+    ============
+
+    Benchmarks the walks of :mod:`du` on synthetic directory trees.
+
+    The trees are generated from a fixed seed into a temporary directory, so
+    runs are comparable.  Each of `dir_and_filenames()`, `dir_statistic()`
+    and `print_sizes()` is timed with every walk strategy it supports, and
+    the file system calls are counted by wrapping `scandir()` and the
+    functions of :mod:`os`.
+
+    Usage::
+
+        $ python du_benchmark.py --scale 2 --jobs 8
+"""
+
+from __future__ import division
+
+import os
+import sys
+import shutil
+import random
+import tempfile
+from timeit import default_timer
+from argparse import ArgumentParser
+from itertools import chain, ifilterfalse, imap
+
+import du
+
+
+def _create_file(path, size):
+    # Truncating is much faster than writing and the size is all that
+    # matters.
+    with open(path, 'wb') as stream:
+        stream.truncate(size)
+
+
+def make_wide_flat(root, scale, rng):
+    """A single directory with many files."""
+    for index in range(5000 * scale):
+        _create_file(os.path.join(root, 'file%d' % index),
+                     rng.randint(0, 64 * 1024))
+
+
+def make_deep_narrow(root, scale, rng):
+    """A long chain of directories with a few files each."""
+    # The depth is fixed to stay well below the maximum path length.
+    path = root
+    for depth in range(200):
+        path = os.path.join(path, 'level%d' % depth)
+        os.mkdir(path)
+        for index in range(3 * scale):
+            _create_file(os.path.join(path, 'file%d' % index),
+                         rng.randint(0, 16 * 1024))
+
+
+def make_many_small_files(root, scale, rng):
+    """A balanced tree of directories full of small files."""
+    for top in range(10 * scale):
+        for sub in range(10):
+            path = os.path.join(root, 'dir%d' % top, 'sub%d' % sub)
+            os.makedirs(path)
+            for index in range(50):
+                _create_file(os.path.join(path, 'file%d' % index),
+                             rng.randint(0, 512))
+
+
+def make_hardlink_heavy(root, scale, rng):
+    """Snapshot directories which hard link mostly the same files, like
+    backups made with ``rsync --link-dest``.
+    """
+    originals = os.path.join(root, 'snapshot0')
+    os.mkdir(originals)
+    names = ['file%d' % index for index in range(500 * scale)]
+    for name in names:
+        _create_file(os.path.join(originals, name),
+                     rng.randint(0, 256 * 1024))
+    for snapshot in range(1, 10):
+        path = os.path.join(root, 'snapshot%d' % snapshot)
+        os.mkdir(path)
+        for name in names:
+            if rng.random() < 0.9:
+                os.link(os.path.join(originals, name),
+                        os.path.join(path, name))
+            else:
+                _create_file(os.path.join(path, name),
+                             rng.randint(0, 256 * 1024))
+
+
+#: Generators of synthetic trees by name.
+TREES = [('wide-flat', make_wide_flat),
+         ('deep-narrow', make_deep_narrow),
+         ('many-small-files', make_many_small_files),
+         ('hardlink-heavy', make_hardlink_heavy)]
+
+
+def legacy_dir_and_filenames(path):
+    """`du.dir_and_filenames()` before it used `scandir()`."""
+    dirnames = []
+    filenames_and_sizes = []
+    for name in os.listdir(path):
+        fullname = os.path.join(path, name)
+        if not os.path.islink(fullname):
+            if os.path.isdir(fullname):
+                dirnames.append(name)
+            elif os.path.isfile(fullname):
+                filenames_and_sizes.append((name, os.path.getsize(fullname)))
+    dirnames.sort()
+    filenames_and_sizes.sort()
+    return (dirnames, filenames_and_sizes)
+
+
+def legacy_dir_statistic(path):
+    """`du.dir_statistic()` before it used `scandir()`."""
+    dir_count = 0
+    file_count = 0
+    total_size = 0
+    for pathname, dirnames, filenames in os.walk(path):
+        dir_count += len(dirnames)
+        file_count += len(filenames)
+        fullnames = (os.path.join(pathname, x) for x in
+                     chain(dirnames, filenames))
+        total_size += sum(imap(os.path.getsize,
+                               ifilterfalse(os.path.islink, fullnames)))
+    return (dir_count, file_count, total_size)
+
+
+class _CountingEntry(object):
+    """Wraps a `DirEntry` to count the calls which need a system call."""
+
+    def __init__(self, entry, counter):
+        self._entry = entry
+        self._counter = counter
+        self._stat_cached = set()
+        self.name = entry.name
+        self.path = entry.path
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks not in self._stat_cached:
+            self._stat_cached.add(follow_symlinks)
+            self._counter.count('stat')
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, follow_symlinks=True):
+        # Following a symbolic link needs a stat() of the target.
+        if follow_symlinks and self._entry.is_symlink():
+            self.stat()
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        if follow_symlinks and self._entry.is_symlink():
+            self.stat()
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+
+class SyscallCounter(object):
+    """Counts the file system calls of :mod:`du` while it is installed.
+
+    Listing a directory counts as one call, although large directories need
+    several ``getdents()`` calls.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self._originals = []
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def total(self):
+        return sum(self.calls.itervalues())
+
+    def _patch(self, namespace, name, replacement):
+        self._originals.append((namespace, name, getattr(namespace, name)))
+        setattr(namespace, name, replacement)
+
+    def _counting(self, name, function):
+        def counting(*args, **kwargs):
+            self.count(name)
+            return function(*args, **kwargs)
+        return counting
+
+    def __enter__(self):
+        scandir = du.scandir
+
+        def counting_scandir(path):
+            self.count('scandir')
+            return (_CountingEntry(entry, self) for entry in scandir(path))
+        self._patch(du, 'scandir', counting_scandir)
+        for name in ('stat', 'lstat', 'listdir'):
+            self._patch(os, name, self._counting(name, getattr(os, name)))
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._originals:
+            namespace, name, original = self._originals.pop()
+            setattr(namespace, name, original)
+
+
+class _NullStream(object):
+
+    def write(self, data):
+        pass
+
+
+def print_sizes_quietly(*args, **kwargs):
+    stdout = sys.stdout
+    sys.stdout = _NullStream()
+    try:
+        du.print_sizes(*args, **kwargs)
+    finally:
+        sys.stdout = stdout
+
+
+def strategies(root, jobs, cache_filename):
+    """Returns the benchmarks for the tree at `root` as tuples of function
+    name, strategy name and a callable.
+    """
+    cache = du.SizeCache(cache_filename)
+    return [
+        ('dir_and_filenames', 'legacy',
+         lambda: legacy_dir_and_filenames(root)),
+        ('dir_and_filenames', 'scandir', lambda: du.dir_and_filenames(root)),
+        ('dir_statistic', 'legacy', lambda: legacy_dir_statistic(root)),
+        ('dir_statistic', 'scandir', lambda: du.dir_statistic(root)),
+        ('dir_statistic', 'parallel',
+         lambda: du.parallel_dir_statistics([root], jobs)),
+        ('dir_statistic', 'inodes',
+         lambda: du.dir_statistic(root, du.InodeSet())),
+        # The first run fills the cache, the following ones use it.
+        ('dir_statistic', 'cache', lambda: cache.dir_statistic(root)),
+        ('print_sizes', 'scandir', lambda: print_sizes_quietly(root)),
+        ('print_sizes', 'parallel',
+         lambda: print_sizes_quietly(root, jobs)),
+        ('print_sizes', 'cache',
+         lambda: print_sizes_quietly(root, cache=cache)),
+    ]
+
+
+def run_benchmark(function, repeat):
+    """Runs `function` `repeat` times.
+
+    :returns: the best time in seconds and the number of system calls of
+        the last run, when caches are filled.
+    """
+    best = None
+    for _ in range(repeat):
+        with SyscallCounter() as counter:
+            start = default_timer()
+            function()
+            elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, counter.total())
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the walks of du.py.')
+    parser.add_argument('-s', '--scale', type=int, default=1,
+                        help='Make the trees SCALE times larger '
+                        '(default: %(default)s).')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Threads of the parallel walk '
+                        '(default: %(default)s).')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Report the best of REPEAT runs '
+                        '(default: %(default)s).')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Seed of the tree generator '
+                        '(default: %(default)s).')
+    parser.add_argument('-d', '--directory',
+                        help='Create the trees in DIRECTORY, which should '
+                        'be on the file system to measure (default: the '
+                        'temporary directory).')
+    args = parser.parse_args()
+
+    print '%-17s %-18s %-9s %8s %9s %12s %9s' % (
+        'tree', 'function', 'strategy', 'entries', 'seconds', 'entries/s',
+        'calls/ent')
+    print ':' * 88
+    workdir = tempfile.mkdtemp(prefix='du_benchmark', dir=args.directory)
+    try:
+        for name, make_tree in TREES:
+            root = os.path.join(workdir, name)
+            os.mkdir(root)
+            make_tree(root, args.scale, random.Random(args.seed))
+            (dir_count, file_count, _) = du.dir_statistic(root)
+            top_entries = sum(imap(len, du.dir_and_filenames(root)))
+            benchmarks = strategies(root, args.jobs,
+                                    os.path.join(workdir, name + '.db'))
+            for function, strategy, benchmark in benchmarks:
+                if function == 'dir_and_filenames':
+                    entries = top_entries
+                else:
+                    entries = dir_count + file_count
+                (seconds, calls) = run_benchmark(benchmark, args.repeat)
+                print '%-17s %-18s %-9s %8d %9.4f %12.0f %9.2f' % (
+                    name, function, strategy, entries, seconds,
+                    entries / seconds if seconds else 0,
+                    calls / entries if entries else 0)
+            shutil.rmtree(root)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
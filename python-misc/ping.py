@@ -14,7 +14,8 @@
 # version 2. Provided with no warranties of any sort.
 
 # Note that ICMP messages can only be sent from processes running
-# as root.
+# as root, unless Linux allows ICMP datagram sockets to the group of the
+# process in net.ipv4.ping_group_range.
 
 # Revision history:
 #
@@ -33,6 +34,33 @@
 # Changed the struct.pack() calls to pack the checksum and ID as
 # unsigned. My thanks to Jerome Poincheval for the fix.
 #
+# Added sweep() to ping many hosts from a single socket, and pack the
+# sequence number as unsigned, too.
+#
+# Sum the words of the checksum in bulk with array (or numpy for large
+# packets) instead of one at a time.
+#
+# Runs on Python 3, too, so aioping.py can share the packet format.
+#
+# Added a continuous mode, which prints a summary like iputils' ping
+# without keeping all delays.
+#
+# Use ICMP datagram sockets where Linux allows them, so root privileges
+# aren't needed.
+#
+# Added ICMPv6 echo requests for IPv6 addresses.
+#
+# Measure delays with a monotonic clock where there is one, and
+# optionally take receive times from the kernel.
+#
+# Added PacketBatch to send and receive many packets per system call
+# with sendmmsg() and recvmmsg().
+#
+# Sweep the hosts of a file, resolving them in a pool of threads while
+# the first ones are already pinged.
+#
+
+from __future__ import print_function
 
 import os
 from socket import *
@@ -40,29 +68,67 @@ import struct
 import select
 import time
 import sys
+import errno
+import math
+import ctypes
+import ctypes.util
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from array import array
+from collections import deque, OrderedDict
+from argparse import ArgumentParser
 
 # From /usr/include/linux/icmp.h; your milage may vary.
+ICMP_ECHO_REPLY=0
 ICMP_ECHO_REQUEST=8 # Seems to be the same on Solaris.
+# From RFC 4443.
+ICMP6_ECHO_REQUEST=128
+ICMP6_ECHO_REPLY=129
+# From /usr/include/asm-generic/socket.h; SCM_TIMESTAMPNS is the same.
+SO_TIMESTAMPNS=35
+
+# Delays are measured on this clock, which doesn't jump when the time of
+# the system is set, unless Python 2 has to do without.
+timer=getattr(time,"monotonic",time.time)
+
+# Below this many bytes summing with array is faster than with numpy.
+NUMPY_CHECKSUM_SIZE=1024
+# Loading numpy takes longer than most pings, so it's only imported for
+# the first large packet. None until then, False if it isn't installed.
+numpy=None
 
 # I'm not too confident that this is right but testing seems
 # to suggest that it gives the same answers as in_cksum in ping.c
 def checksum(str):
-  sum=0
-  countTo=(len(str)/2)*2
-  count=0
-  while count<countTo:
-    thisVal=ord(str[count+1])*256+ord(str[count])
-    sum=sum+thisVal
-    sum=sum & 0xffffffff # Necessary?
-    count=count+2
+  global numpy
+  # The words are summed in little endian order, whatever the machine.
+  countTo=(len(str)//2)*2
+  if numpy is None and countTo>=NUMPY_CHECKSUM_SIZE:
+    try:
+      import numpy
+    except ImportError:
+      numpy=False
+  if numpy and countTo>=NUMPY_CHECKSUM_SIZE:
+    words=numpy.frombuffer(str,"<u2",countTo//2)
+    total=int(words.sum(dtype=numpy.uint64))
+  else:
+    words=array("H",str[:countTo])
+    if sys.byteorder=="big":
+      words.byteswap()
+    total=sum(words)
 
   if countTo<len(str):
-    sum=sum+ord(str[len(str)-1])
-    sum=sum & 0xffffffff # Necessary?
+    total=total+bytearray(str[-1:])[0]
+  return finishChecksum(total)
+
+def finishChecksum(total):
+  # Returns the checksum for the sum of the words of a packet.
+  total=total & 0xffffffff # Necessary?
 
-  sum=(sum >> 16) + (sum & 0xffff)
-  sum=sum+(sum >> 16)
-  answer=~sum
+  total=(total >> 16) + (total & 0xffff)
+  total=total+(total >> 16)
+  answer=~total
   answer=answer & 0xffff
 
   # Swap bytes. Bugger me if I know why.
@@ -70,7 +136,7 @@ def checksum(str):
   
   return answer
 
-def receiveOnePing(mySocket,ID,timeout):
+def receiveOnePing(mySocket,ID,timeout,timestamps=False):
   timeLeft=timeout
   while 1:
     startedSelect=time.time()
@@ -78,54 +144,835 @@ def receiveOnePing(mySocket,ID,timeout):
     howLongInSelect=(time.time()-startedSelect)
     if whatReady[0]==[]: # Timeout
       return None
-    timeReceived=time.time()
-    recPacket,addr=mySocket.recvfrom(1024)
-    icmpHeader=recPacket[20:28]
-    type,code,checksum,packetID,sequence=struct.unpack("bbHHh",icmpHeader)
-    if packetID==ID:
-      bytesInDouble=struct.calcsize("d")
-      timeSent=struct.unpack("d",recPacket[28:28+bytesInDouble])[0]
-      return timeReceived-timeSent
+    recPacket,addr,timeReceived=receivePacket(mySocket,0,timestamps)
+    reply=unpackReply(recPacket,ipHeaderSize(mySocket,recPacket))
+    # Raw sockets see our own requests to local addresses, too, and any
+    # other ICMP traffic.
+    if reply is not None:
+      type,packetID,sequence,timeSent=reply
+      if packetID==ID and type in (ICMP_ECHO_REPLY,ICMP6_ECHO_REPLY):
+        return timeReceived-timeSent
       
     timeLeft=timeLeft-howLongInSelect
     if timeLeft<=0:
       return None
 
-def sendOnePing(mySocket,destAddr,ID):
+def sendOnePing(mySocket,destAddr,ID,sequence=1):
   # Header is type (8), code (8), checksum (16), id (16), sequence (16)
   myChecksum=0
-  # Make a dummy heder with a 0 checksum.
-  header=struct.pack("bbHHh",ICMP_ECHO_REQUEST,0,myChecksum,ID,1)
   bytesInDouble=struct.calcsize("d")
-  data=(192-bytesInDouble) * "Q"
-  data=struct.pack("d",time.time())+data
+  data=(192-bytesInDouble) * b"Q"
+  data=struct.pack("d",timer())+data
+  if mySocket.family==AF_INET6:
+    # The kernel computes ICMPv6 checksums, which cover a pseudo header
+    # with the addresses of the IPv6 header.
+    header=struct.pack("BBHHH",ICMP6_ECHO_REQUEST,0,myChecksum,ID,sequence)
+    mySocket.sendto(header+data,(destAddr,0))
+    return None
+  # Make a dummy heder with a 0 checksum.
+  header=struct.pack("bbHHH",ICMP_ECHO_REQUEST,0,myChecksum,ID,sequence)
   # Calculate the checksum on the data and the dummy header.
   myChecksum=checksum(header+data)
   # Now that we have the right checksum, we put that in. It's just easier
   # to make up a new header than to stuff it into the dummy.
-  header=struct.pack("bbHHh",ICMP_ECHO_REQUEST,0,htons(myChecksum),ID,1)
+  header=struct.pack("bbHHH",ICMP_ECHO_REQUEST,0,htons(myChecksum),ID,
+    sequence)
   packet=header+data
   mySocket.sendto(packet,(destAddr,1)) # Don't know about the 1 
   return None
   
-def doOne(destAddr,timeout=10):
+def openIcmpSocket(kind=None,family=AF_INET):
+  # Returns an ICMP socket and the ID for its requests. kind is SOCK_RAW,
+  # SOCK_DGRAM, or None to use a datagram socket if allowed and a raw one
+  # otherwise. The kernel passes only our own replies to datagram sockets,
+  # without the IP header, and rewrites the ID of their requests. family
+  # is AF_INET, or AF_INET6 for an ICMPv6 socket.
+  if family==AF_INET6:
+    icmp=IPPROTO_ICMPV6
+  else:
+    icmp=getprotobyname("icmp")
+  kinds=kind is None and (SOCK_DGRAM,SOCK_RAW) or (kind,)
+  for kind in kinds:
+    try:
+      mySocket=socket(family,kind,icmp)
+    except error as e:
+      if kind==kinds[-1] or e.args[0] not in (errno.EACCES,errno.EPERM,
+                                              errno.EPROTONOSUPPORT):
+        raise
+      continue
+    if kind==SOCK_RAW:
+      return mySocket,os.getpid() & 0xFFFF
+    # Binding picks the ID, which the kernel writes in network byte
+    # order. Since we pack it in native order, use the same bytes.
+    mySocket.bind(("",0))
+    ident=mySocket.getsockname()[1]
+    return mySocket,struct.unpack("H",struct.pack("!H",ident))[0]
+
+def ipHeaderSize(mySocket,recPacket):
+  # Returns the size of the IP header before the ICMP message in
+  # recPacket, which raw IPv4 sockets receive but datagram and IPv6
+  # sockets don't.
+  if mySocket.type!=SOCK_RAW or mySocket.family==AF_INET6:
+    return 0
+  return (bytearray(recPacket[:1])[0] & 0x0F)*4
+
+def addressFamily(destAddr):
+  # Returns AF_INET6 for IPv6 addresses and AF_INET otherwise.
+  if ":" in destAddr:
+    return AF_INET6
+  return AF_INET
+
+def resolve(host,family=None):
+  # Returns an address of host, an IPv4 one if there is any unless family
+  # asks for AF_INET6.
+  families=family and (family,) or (AF_INET,AF_INET6)
+  for family in families:
+    try:
+      addresses=getaddrinfo(host,None,family,SOCK_RAW)
+    except gaierror:
+      if family==families[-1]:
+        raise
+      continue
+    return addresses[0][4][0]
+
+def enableTimestamps(mySocket):
+  # Makes the kernel stamp the packets received by mySocket with their
+  # arrival time, so receivePacket() doesn't count the time until we get
+  # around to reading them. Returns False if the stamps can't be read
+  # because socket.recvmsg() is missing, as it is in Python 2.
+  if not hasattr(mySocket,"recvmsg"):
+    return False
+  mySocket.setsockopt(SOL_SOCKET,SO_TIMESTAMPNS,1)
+  return True
+
+def receivePacket(mySocket,flags=0,timestamps=False):
+  # Returns a packet, its sender and its arrival time on the clock of
+  # timer(). With timestamps the time comes from the kernel, if
+  # enableTimestamps() was called for mySocket.
+  if not timestamps:
+    recPacket,addr=mySocket.recvfrom(1024,flags)
+    return recPacket,addr,timer()
+  timespecSize=struct.calcsize("ll")
+  recPacket,ancdata,msgFlags,addr=mySocket.recvmsg(1024,
+    CMSG_SPACE(timespecSize),flags)
+  timeReceived=timer()
+  wallTime=time.time()
+  for level,type,data in ancdata:
+    if level==SOL_SOCKET and type==SO_TIMESTAMPNS:
+      timeReceived=stampedTime(data,timeReceived,wallTime)
+  return recPacket,addr,timeReceived
+
+def stampedTime(timespec,timeReceived,wallTime):
+  # Returns the time on the clock of timer() for the struct timespec of
+  # a kernel stamp, given the time the packet was read on both clocks.
+  seconds,nanoseconds=struct.unpack("ll",timespec[:struct.calcsize("ll")])
+  # The stamp is on the wall clock, so we need its age.
+  age=wallTime-seconds-nanoseconds*1e-9
+  return timeReceived-max(age,0)
+
+class DnsCache(object):
+  # Remembers the addresses of host names, and names which don't resolve,
+  # for at most ttl seconds. getaddrinfo() doesn't tell the TTLs of the
+  # DNS records, so that is all we can do. Safe to use from threads.
+  def __init__(self,ttl=300):
+    self.ttl=ttl
+    self.entries={}
+    self.lock=threading.Lock()
+
+  def resolve(self,host,family=None):
+    # Like resolve(), from the cache if possible.
+    key=(host,family)
+    now=timer()
+    with self.lock:
+      expires,result=self.entries.get(key,(now,None))
+    if expires<=now:
+      try:
+        result=resolve(host,family)
+      except gaierror as e:
+        result=e
+      with self.lock:
+        # Forget the expired names once in a while.
+        if len(self.entries)>=1024 and len(self.entries)%1024==0:
+          for other,(otherExpires,otherResult) in list(self.entries.items()):
+            if otherExpires<=now:
+              del self.entries[other]
+        self.entries[key]=(now+self.ttl,result)
+    if isinstance(result,Exception):
+      raise result
+    return result
+
+def resolveAll(hosts,family=None,threads=16,cache=None):
+  # Resolves the host names in hosts, which may be any iterable, in a pool
+  # of threads. Yields a (host, address) pair as soon as each is known,
+  # with None as address for names which don't resolve. Yields None when
+  # no name is resolved yet, so the caller can do something else in the
+  # meantime. cache is a DnsCache.
+  if cache is None:
+    cache=DnsCache()
+  def lookup(host):
+    try:
+      return host,cache.resolve(host,family)
+    except (gaierror,UnicodeError):
+      return host,None
+  pool=ThreadPool(threads)
+  try:
+    results=pool.imap_unordered(lookup,hosts)
+    while 1:
+      try:
+        yield results.next(0)
+      except multiprocessing.TimeoutError:
+        yield None
+      except StopIteration:
+        return
+  finally:
+    pool.terminate()
+
+def readHosts(stream):
+  # Yields the host names in stream, one per line, without blank lines
+  # and comments after "#".
+  for line in stream:
+    host=line.split("#",1)[0].strip()
+    if host:
+      yield host
+
+def doOne(destAddr,timeout=10,timestamps=False):
   # Returns either the delay (in seconds) or none on timeout.
-  icmp=getprotobyname("icmp")
-  mySocket=socket(AF_INET,SOCK_RAW,icmp)
-  myID=os.getpid() & 0xFFFF
+  mySocket,myID=openIcmpSocket(family=addressFamily(destAddr))
+  timestamps=timestamps and enableTimestamps(mySocket)
   sendOnePing(mySocket,destAddr,myID)
-  delay=receiveOnePing(mySocket,myID,timeout)
+  delay=receiveOnePing(mySocket,myID,timeout,timestamps)
   mySocket.close()
   return delay
 
+def unpackReply(recPacket,headerSize=20):
+  # Returns the type, ID, sequence and send time of an ICMP packet
+  # received after an IP header of headerSize bytes, or None if the
+  # packet is too short to be one of our replies.
+  bytesInDouble=struct.calcsize("d")
+  if len(recPacket)<headerSize+8+bytesInDouble:
+    return None
+  icmpHeader=recPacket[headerSize:headerSize+8]
+  type,code,checksum,packetID,sequence=struct.unpack("BBHHH",icmpHeader)
+  timeSent=struct.unpack("d",
+    recPacket[headerSize+8:headerSize+8+bytesInDouble])[0]
+  return type,packetID,sequence,timeSent
+
+def receivePings(mySocket,pending,timestamps=False,packets=None):
+  # Reads all replies waiting on mySocket without blocking. pending maps
+  # the (ID, sequence) pairs of the requests still waiting for a reply to
+  # their destination; answered ones are removed from it. Returns a list
+  # of the (ID, sequence) pair, destination and delay (in seconds) of
+  # every reply. The replies are read in batches if packets is the
+  # PacketBatch of mySocket.
+  replies=[]
+  received=[]
+  # Like ipHeaderSize(), but the attributes of sockets are slow to read.
+  withHeader=mySocket.type==SOCK_RAW and mySocket.family!=AF_INET6
+  while 1:
+    if not received:
+      try:
+        if packets is None:
+          received=[receivePacket(mySocket,MSG_DONTWAIT,timestamps)]
+        else:
+          received=packets.receive()
+      except error as e:
+        if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+          return replies
+        raise
+      received.reverse()
+    recPacket,addr,timeReceived=received.pop()
+    headerSize=withHeader and (bytearray(recPacket[:1])[0] & 0x0F)*4 or 0
+    reply=unpackReply(recPacket,headerSize)
+    if reply is None:
+      continue
+    type,packetID,sequence,timeSent=reply
+    key=(packetID,sequence)
+    # A raw socket sees all ICMP traffic, including our own requests to
+    # local addresses and replies to other processes.
+    if type not in (ICMP_ECHO_REPLY,ICMP6_ECHO_REPLY) or \
+       pending.get(key)!=addr[0]:
+      continue
+    del pending[key]
+    replies.append((key,addr[0],timeReceived-timeSent))
+
+# The structures of sendmmsg() and recvmmsg() from <sys/socket.h>.
+class IoVec(ctypes.Structure):
+  _fields_=[("base",ctypes.c_void_p),("len",ctypes.c_size_t)]
+
+class MsgHdr(ctypes.Structure):
+  _fields_=[("name",ctypes.c_void_p),("namelen",ctypes.c_uint32),
+            ("iov",ctypes.POINTER(IoVec)),("iovlen",ctypes.c_size_t),
+            ("control",ctypes.c_void_p),("controllen",ctypes.c_size_t),
+            ("flags",ctypes.c_int)]
+
+class MMsgHdr(ctypes.Structure):
+  _fields_=[("hdr",MsgHdr),("len",ctypes.c_uint)]
+
+try:
+  libc=ctypes.CDLL(ctypes.util.find_library("c"),use_errno=True)
+  libc.sendmmsg.argtypes=[ctypes.c_int,ctypes.c_void_p,ctypes.c_uint,
+                          ctypes.c_int]
+  libc.recvmmsg.argtypes=[ctypes.c_int,ctypes.c_void_p,ctypes.c_uint,
+                          ctypes.c_int,ctypes.c_void_p]
+except (OSError,AttributeError):
+  libc=None
+
+class PacketBatch(object):
+  # Sends echo requests from mySocket and reads the replies, up to size
+  # packets per system call with sendmmsg() and recvmmsg() where the C
+  # library has them, and one by one otherwise.
+  #
+  # All packets live in buffers allocated up front. The requests are
+  # copies of a template, in which only the ID, sequence, timestamp and
+  # checksum are patched. The checksum is finished from the precomputed
+  # sum of the constant part of the template.
+  PACKET_SIZE=200
+  RECEIVE_SIZE=1024
+  SOCKADDR_SIZE=28   # Of struct sockaddr_in6, the larger one.
+  CONTROL_SIZE=64    # For a struct cmsghdr with a struct timespec.
+
+  def __init__(self,mySocket,size=64,timestamps=False,useMMsg=None):
+    self.mySocket=mySocket
+    self.size=size
+    self.timestamps=timestamps
+    if useMMsg is None:
+      useMMsg=libc is not None
+    self.useMMsg=useMMsg
+    self.family=mySocket.family
+    self.count=0
+    self.destAddrs=[None]*size
+    self.vectors=[]
+    ipv6=self.family==AF_INET6
+    self.requestType=ipv6 and ICMP6_ECHO_REQUEST or ICMP_ECHO_REQUEST
+    # Like sendOnePing(), which doesn't know about the 1 either.
+    self.port=not ipv6 and 1 or 0
+    bytesInDouble=struct.calcsize("d")
+    self.tail=(192-bytesInDouble) * b"Q"
+    # The kernel computes ICMPv6 checksums.
+    self.tailSum=None
+    if not ipv6:
+      words=array("H",self.tail)
+      if sys.byteorder=="big":
+        words.byteswap()
+      self.tailSum=sum(words)
+
+    self.packets=ctypes.create_string_buffer(self.PACKET_SIZE*size)
+    self.names=ctypes.create_string_buffer(self.SOCKADDR_SIZE*size)
+    self.sendMsgs=self.messages(self.packets,self.PACKET_SIZE,self.names,
+                                None,0)
+    for index in range(size):
+      offset=index*self.PACKET_SIZE
+      struct.pack_into("=BBHHHd",self.packets,offset,self.requestType,0,0,0,
+                       0,0)
+      self.packets[offset+16:offset+self.PACKET_SIZE]=self.tail
+    self.received=ctypes.create_string_buffer(self.RECEIVE_SIZE*size)
+    self.senders=ctypes.create_string_buffer(self.SOCKADDR_SIZE*size)
+    self.controls=ctypes.create_string_buffer(self.CONTROL_SIZE*size)
+    self.recvMsgs=self.messages(self.received,self.RECEIVE_SIZE,
+                                self.senders,self.controls,
+                                self.CONTROL_SIZE)
+
+  def messages(self,buffers,bufferSize,names,controls,controlSize):
+    # Returns an array of struct mmsghdr pointing into buffers, names and
+    # controls.
+    iovs=(IoVec*self.size)()
+    msgs=(MMsgHdr*self.size)()
+    base=ctypes.addressof(buffers)
+    names=ctypes.addressof(names)
+    for index in range(self.size):
+      iovs[index].base=base+index*bufferSize
+      iovs[index].len=bufferSize
+      hdr=msgs[index].hdr
+      hdr.name=names+index*self.SOCKADDR_SIZE
+      hdr.namelen=self.SOCKADDR_SIZE
+      hdr.iov=ctypes.pointer(iovs[index])
+      hdr.iovlen=1
+      if controls is not None:
+        hdr.control=ctypes.addressof(controls)+index*controlSize
+        hdr.controllen=controlSize
+    # The messages only point to the vectors.
+    self.vectors.append(iovs)
+    return msgs
+
+  def add(self,destAddr,ID,sequence):
+    # Queues a request to destAddr, and sends all queued ones if there is
+    # no room for more.
+    index=self.count
+    struct.pack_into("=HH",self.packets,index*self.PACKET_SIZE+4,ID,
+                     sequence)
+    nameOffset=index*self.SOCKADDR_SIZE
+    if self.family==AF_INET6:
+      # Link local addresses name their interface after a "%".
+      host,scope=(destAddr.split("%")+[None])[:2]
+      scopeID=scope and if_nametoindex(scope) or 0
+      struct.pack_into("=HHI16sI",self.names,nameOffset,AF_INET6,0,0,
+                       inet_pton(AF_INET6,host),scopeID)
+      self.sendMsgs[index].hdr.namelen=28
+    else:
+      struct.pack_into("=HH4s8x",self.names,nameOffset,AF_INET,
+                       htons(self.port),
+                       inet_pton(AF_INET,destAddr))
+      self.sendMsgs[index].hdr.namelen=16
+    self.destAddrs[index]=destAddr
+    self.count=index+1
+    if self.count==self.size:
+      self.flush()
+
+  def flush(self):
+    # Sends all queued requests, stamped with the current time.
+    count=self.count
+    self.count=0
+    timeSent=timer()
+    for offset in range(0,count*self.PACKET_SIZE,self.PACKET_SIZE):
+      struct.pack_into("=H",self.packets,offset+2,0)
+      struct.pack_into("=d",self.packets,offset+8,timeSent)
+      if self.tailSum is not None:
+        # The sum of the first word is constant, too, but cheap.
+        words=struct.unpack_from("<8H",self.packets,offset)
+        myChecksum=finishChecksum(self.tailSum+sum(words))
+        struct.pack_into("H",self.packets,offset+2,htons(myChecksum))
+    sent=0
+    while sent<count:
+      if not self.useMMsg:
+        offset=sent*self.PACKET_SIZE
+        self.mySocket.sendto(self.packets[offset:offset+self.PACKET_SIZE],
+                             (self.destAddrs[sent],self.port))
+        sent=sent+1
+        continue
+      result=libc.sendmmsg(self.mySocket.fileno(),
+        ctypes.addressof(self.sendMsgs)+sent*ctypes.sizeof(MMsgHdr),
+        count-sent,0)
+      if result<0:
+        code=ctypes.get_errno()
+        if code==errno.EINTR:
+          continue
+        raise error(code,os.strerror(code))
+      sent=sent+result
+
+  def receive(self):
+    # Returns a list of the packets waiting on the socket, up to size,
+    # with their sender and arrival time like receivePacket() does.
+    if not self.useMMsg:
+      packets=[]
+      while len(packets)<self.size:
+        try:
+          packets.append(receivePacket(self.mySocket,MSG_DONTWAIT,
+                                       self.timestamps))
+        except error as e:
+          if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK) and packets:
+            break
+          raise
+      return packets
+    for index in range(self.size):
+      hdr=self.recvMsgs[index].hdr
+      hdr.namelen=self.SOCKADDR_SIZE
+      hdr.controllen=self.timestamps and self.CONTROL_SIZE or 0
+    result=libc.recvmmsg(self.mySocket.fileno(),
+                         ctypes.addressof(self.recvMsgs),self.size,
+                         MSG_DONTWAIT,None)
+    timeReceived=timer()
+    wallTime=time.time()
+    if result<0:
+      code=ctypes.get_errno()
+      raise error(code,os.strerror(code))
+    packets=[]
+    # struct cmsghdr starts with a size_t, which is a long on Linux.
+    cmsgSize=struct.calcsize("@Lii")
+    for index in range(result):
+      msg=self.recvMsgs[index]
+      offset=index*self.RECEIVE_SIZE
+      recPacket=self.received[offset:offset+msg.len]
+      nameOffset=index*self.SOCKADDR_SIZE
+      if self.family==AF_INET6:
+        host=inet_ntop(AF_INET6,self.senders[nameOffset+8:nameOffset+24])
+      else:
+        host=inet_ntop(AF_INET,self.senders[nameOffset+4:nameOffset+8])
+      packetTime=timeReceived
+      if msg.hdr.controllen>=cmsgSize:
+        offset=index*self.CONTROL_SIZE
+        length,level,type=struct.unpack_from("@Lii",self.controls,offset)
+        if level==SOL_SOCKET and type==SO_TIMESTAMPNS:
+          packetTime=stampedTime(
+            self.controls[offset+cmsgSize:offset+length],timeReceived,
+            wallTime)
+      packets.append((recPacket,(host,0),packetTime))
+    return packets
+
+def sweep(destAddrs,timeout=1,rate=None,timestamps=False,batch=0):
+  # Pings all addresses in destAddrs from a single socket (one for each
+  # of IPv4 and IPv6) and returns an ordered dict mapping each address to
+  # the delay (in seconds) or None on timeout. destAddrs may be any
+  # iterable, addresses are taken from it only when they are due; it may
+  # yield None if the next address isn't known yet. At most
+  # rate packets are sent per second if rate is given. With timestamps
+  # the kernel stamps arriving replies. With batch, the requests which
+  # are due and the replies are passed in batches of up to that many
+  # packets per system call (see PacketBatch).
+  #
+  # Every host gets its own ID/sequence pair, so a single select() loop
+  # can tell all replies apart. Up to 2**32 hosts are unique on raw
+  # sockets, 2**16 on datagram sockets, which have a single ID.
+  sockets={}
+  results=OrderedDict()
+  pending={}
+  deadlines=deque()
+  targets=iter(destAddrs)
+  interval=rate and 1.0/rate or 0
+  count=0
+  nextSend=time.time()
+  exhausted=False
+  try:
+    while not exhausted or pending:
+      now=time.time()
+      if not exhausted and now>=nextSend:
+        try:
+          destAddr=next(targets)
+        except StopIteration:
+          exhausted=True
+          continue
+        if destAddr is None:
+          # Look again soon, but answer replies in the meantime.
+          nextSend=now+0.01
+          continue
+        family=addressFamily(destAddr)
+        if family not in sockets:
+          mySocket,baseID=openIcmpSocket(family=family)
+          # Don't drop replies arriving in bursts while we are sending.
+          mySocket.setsockopt(SOL_SOCKET,SO_RCVBUF,1<<20)
+          timestamps=timestamps and enableTimestamps(mySocket)
+          idCount=mySocket.type==SOCK_RAW and 0x10000 or 1
+          packets=batch and PacketBatch(mySocket,batch,timestamps) or None
+          sockets[family]=mySocket,baseID,idCount,packets
+        mySocket,baseID,idCount,packets=sockets[family]
+        ID=(baseID+(count>>16)%idCount) & 0xFFFF
+        sequence=count & 0xFFFF
+        count=count+1
+        results[destAddr]=None
+        pending[(ID,sequence)]=destAddr
+        deadlines.append((time.time()+timeout,(ID,sequence)))
+        nextSend=max(nextSend+interval,now)
+        if packets is not None:
+          # Sent when full or when nothing else is due.
+          packets.add(destAddr,ID,sequence)
+          if packets.count:
+            continue
+        else:
+          sendOnePing(mySocket,destAddr,ID,sequence)
+        for key,replyAddr,delay in receivePings(mySocket,pending,
+                                                timestamps,packets):
+          results[replyAddr]=delay
+        continue
+
+      for mySocket,baseID,idCount,packets in sockets.values():
+        if packets is not None:
+          packets.flush()
+
+      # Requests time out in the order they were sent.
+      while deadlines and (deadlines[0][0]<=now or
+                           deadlines[0][1] not in pending):
+        ID,sequence=deadlines.popleft()[1]
+        pending.pop((ID,sequence),None)
+      wakeUp=[]
+      if not exhausted:
+        wakeUp.append(nextSend)
+      if deadlines:
+        wakeUp.append(deadlines[0][0])
+      if not wakeUp:
+        continue
+      batches=dict((mySocket,packets) for mySocket,baseID,idCount,packets
+                   in sockets.values())
+      whatReady=select.select(list(batches),[],[],max(min(wakeUp)-now,0))
+      for mySocket in whatReady[0]:
+        for key,replyAddr,delay in receivePings(mySocket,pending,
+                                                timestamps,batches[mySocket]):
+          results[replyAddr]=delay
+  finally:
+    for mySocket,baseID,idCount,packets in sockets.values():
+      mySocket.close()
+  return results
+
+class RttStatistics(object):
+  # Keeps statistics of the delays of a continuous ping in constant
+  # memory. Percentiles come from a histogram with buckets growing by
+  # a factor of 2**(1/BUCKETS_PER_DOUBLING), so they are off by at most
+  # that much (about 4.4%).
+  MIN_DELAY=1e-6
+  BUCKETS_PER_DOUBLING=16
+  BUCKETS=30*BUCKETS_PER_DOUBLING+1  # Up to about 18 minutes.
+
+  def __init__(self):
+    self.transmitted=0
+    self.received=0
+    self.min=None
+    self.max=None
+    self.total=0.0
+    self.totalSquares=0.0
+    # Smoothed difference between consecutive delays as in RFC 3550.
+    self.jitter=0.0
+    self.last=None
+    self.buckets=[0]*self.BUCKETS
+
+  def add(self,delay):
+    # Counts a reply with delay seconds. Call transmitted+=1 for requests.
+    self.received=self.received+1
+    if self.min is None or delay<self.min:
+      self.min=delay
+    if self.max is None or delay>self.max:
+      self.max=delay
+    self.total=self.total+delay
+    self.totalSquares=self.totalSquares+delay*delay
+    if self.last is not None:
+      self.jitter=self.jitter+(abs(delay-self.last)-self.jitter)/16
+    self.last=delay
+    if delay<=self.MIN_DELAY:
+      index=0
+    else:
+      index=int(math.log(delay/self.MIN_DELAY,2)*self.BUCKETS_PER_DOUBLING)+1
+    self.buckets[min(index,self.BUCKETS-1)]+=1
+
+  def average(self):
+    return self.total/self.received
+
+  def mdev(self):
+    # The standard deviation, as ping(8) calls it.
+    average=self.average()
+    return math.sqrt(max(self.totalSquares/self.received-average*average,0))
+
+  def percentile(self,percent):
+    # Returns the upper bound of the bucket holding the given percentile.
+    rank=max(int(math.ceil(percent/100.0*self.received)),1)
+    seen=0
+    for index,count in enumerate(self.buckets):
+      seen=seen+count
+      if seen>=rank:
+        break
+    bound=self.MIN_DELAY*2**(index/float(self.BUCKETS_PER_DOUBLING))
+    return min(max(bound,self.min),self.max)
+
+  def summary(self,host,elapsed):
+    # Returns the summary of ping(8) from iputils, with jitter and
+    # percentiles in an extra line.
+    lines=["--- %s ping statistics ---" % host]
+    loss=0
+    if self.transmitted:
+      loss=(self.transmitted-self.received)*100//self.transmitted
+    lines.append("%d packets transmitted, %d received, %d%% packet loss, "
+      "time %dms" % (self.transmitted,self.received,loss,elapsed*1000))
+    if self.received:
+      lines.append("rtt min/avg/max/mdev = %.3f/%.3f/%.3f/%.3f ms" %
+        (self.min*1000,self.average()*1000,self.max*1000,self.mdev()*1000))
+      lines.append("rtt jitter = %.3f ms, p50/p95/p99 = %.3f/%.3f/%.3f ms" %
+        (self.jitter*1000,self.percentile(50)*1000,
+         self.percentile(95)*1000,self.percentile(99)*1000))
+    return "\n".join(lines)
+
+def pingContinuously(destAddr,count=None,interval=1,deadline=None,
+                     timeout=10,statistics=None,report=None,
+                     timestamps=False):
+  # Sends a request to destAddr every interval seconds, count times or
+  # forever, and stops deadline seconds after starting if deadline is
+  # given. Requests without a reply after timeout seconds are lost.
+  # report is called with the sequence number and delay of every reply.
+  # Returns the RttStatistics, which may also be passed in to keep them
+  # when interrupted. With timestamps the kernel stamps arriving replies.
+  if statistics is None:
+    statistics=RttStatistics()
+  mySocket,myID=openIcmpSocket(family=addressFamily(destAddr))
+  # Don't drop replies when requests are sent faster than they are read.
+  mySocket.setsockopt(SOL_SOCKET,SO_RCVBUF,1<<20)
+  timestamps=timestamps and enableTimestamps(mySocket)
+  pending={}
+  deadlines=deque()
+  started=nextSend=time.time()
+  stopAt=deadline is not None and started+deadline or None
+  try:
+    while 1:
+      now=time.time()
+      if stopAt is not None and now>=stopAt:
+        break
+      sending=count is None or statistics.transmitted<count
+      if sending and now>=nextSend:
+        statistics.transmitted=statistics.transmitted+1
+        # Sequence numbers start at 1 like in ping(8).
+        key=(myID,statistics.transmitted & 0xFFFF)
+        pending[key]=destAddr
+        sendOnePing(mySocket,destAddr,*key)
+        deadlines.append((time.time()+timeout,key))
+        nextSend=nextSend+interval
+        # The sequence numbers repeat after 65536 requests, so the oldest
+        # ones are lost by then. This bounds the memory for short intervals.
+        if len(deadlines)>0xFFFF:
+          pending.pop(deadlines.popleft()[1],None)
+        # Take the replies and expire the deadlines below in between
+        # sending, which may be due all the time.
+      while deadlines and (deadlines[0][0]<=now or
+                           deadlines[0][1] not in pending):
+        pending.pop(deadlines.popleft()[1],None)
+      if not sending and not pending:
+        break
+      wakeUp=[]
+      if sending:
+        wakeUp.append(nextSend)
+      if deadlines:
+        wakeUp.append(deadlines[0][0])
+      if stopAt is not None:
+        wakeUp.append(stopAt)
+      whatReady=select.select([mySocket],[],[],max(min(wakeUp)-now,0))
+      if whatReady[0]:
+        for key,replyAddr,delay in receivePings(mySocket,pending,timestamps):
+          statistics.add(delay)
+          if report is not None:
+            report(key[1],delay)
+  finally:
+    mySocket.close()
+  return statistics
+
+def expandTargets(targets,family=None):
+  # Yields the addresses of targets, which are host names, addresses or
+  # networks in CIDR notation like 192.168.0.0/24 or 2001:db8::/120. The
+  # network and broadcast addresses of IPv4 networks are skipped. Host
+  # names are resolved like resolve() does.
+  for target in targets:
+    if "/" not in target:
+      yield resolve(target,family)
+      continue
+    network,prefix=target.split("/")
+    networkFamily=addressFamily(network)
+    bits=networkFamily==AF_INET6 and 128 or 32
+    prefix=int(prefix)
+    first=0
+    for byte in bytearray(inet_pton(networkFamily,network)):
+      first=first << 8 | byte
+    mask=(1 << bits)-1
+    first=first & (mask << (bits-prefix)) & mask
+    last=first | (mask >> prefix)
+    if networkFamily==AF_INET and prefix<31:
+      first,last=first+1,last-1
+    while first<=last:
+      packed=bytearray(bits//8)
+      address=first
+      for index in range(bits//8-1,-1,-1):
+        packed[index]=address & 0xFF
+        address=address >> 8
+      yield inet_ntop(networkFamily,bytes(packed))
+      first=first+1
+
+def continuousMain(host,dest,args):
+  def report(sequence,delay):
+    print("%d bytes from %s: icmp_seq=%d time=%.3f ms" %
+          (200,dest,sequence,delay*1000))
+    sys.stdout.flush()
+  # The IPv6 header has 40 bytes, the IPv4 header 20.
+  headerSize=addressFamily(dest)==AF_INET6 and 40 or 20
+  print("PING %s (%s) 192(%d) bytes of data." % (host,dest,200+headerSize))
+  statistics=RttStatistics()
+  started=time.time()
+  try:
+    pingContinuously(dest,args.count,args.interval,args.deadline,
+                     args.timeout or 10,statistics,report,args.timestamps)
+  except KeyboardInterrupt:
+    pass
+  print()
+  print(statistics.summary(host,time.time()-started))
+
+def hostListMain(stream,args):
+  # Sweeps the hosts named in stream and prints their addresses and
+  # delays in the order they were pinged.
+  names={}
+  unknown=[]
+  def addresses():
+    for result in resolveAll(readHosts(stream),args.family,args.resolvers,
+                             DnsCache(args.dns_ttl)):
+      if result is None:
+        yield None
+        continue
+      host,address=result
+      if address is None:
+        unknown.append(host)
+      elif address in names:
+        names[address].append(host)
+      else:
+        names[address]=[host]
+        yield address
+  results=sweep(addresses(),args.timeout or 1,args.rate,args.timestamps,
+                args.batch)
+  for destAddr,delay in results.items():
+    for host in names[destAddr]:
+      if delay is None:
+        print("%-30s %-15s timeout" % (host,destAddr))
+      else:
+        print("%-30s %-15s %.3f ms" % (host,destAddr,delay*1000))
+  for host in unknown:
+    print("%-30s unknown host" % host)
+
 def main():
-  if len(sys.argv)<2:
-    print "Usage: %s hostname" % os.path.basename(sys.argv[0])
-    sys.exit(1)
+  parser=ArgumentParser(description="Send ICMP echo requests.")
+  parser.add_argument("-s","--sweep",action="store_true",
+    help="Ping all hosts and networks (like 10.0.0.0/16) at once.")
+  parser.add_argument("-r","--rate",type=float,
+    help="Send at most RATE packets per second when sweeping.")
+  parser.add_argument("-W","--timeout",type=float,
+    help="Wait TIMEOUT seconds for replies (default: 10, 1 when sweeping).")
+  parser.add_argument("-C","--continuous",action="store_true",
+    help="Ping until interrupted and print statistics like ping(8).")
+  parser.add_argument("-c","--count",type=int,
+    help="Stop after sending COUNT requests (implies --continuous).")
+  parser.add_argument("-i","--interval",type=float,default=1,
+    help="Wait INTERVAL seconds between requests (default: 1).")
+  parser.add_argument("-w","--deadline",type=float,
+    help="Stop after DEADLINE seconds (implies --continuous).")
+  parser.add_argument("-4",dest="family",action="store_const",
+    const=AF_INET,help="Ping IPv4 addresses of host names only.")
+  parser.add_argument("-6",dest="family",action="store_const",
+    const=AF_INET6,help="Ping IPv6 addresses of host names only.")
+  parser.add_argument("-b","--batch",type=int,default=0,
+    help="Send and receive up to BATCH packets per system call when "
+    "sweeping.")
+  parser.add_argument("-T","--timestamps",action="store_true",
+    help="Take the arrival times of replies from the kernel.")
+  parser.add_argument("-f","--file",
+    help="Sweep the hosts named in FILE, one per line, or - for stdin.")
+  parser.add_argument("--resolvers",type=int,default=16,
+    help="Resolve the names of --file in RESOLVERS threads (default: 16).")
+  parser.add_argument("--dns-ttl",type=float,default=300,
+    help="Remember resolved names for DNS_TTL seconds (default: 300).")
+  parser.add_argument("hosts",nargs="*",metavar="host")
+  args=parser.parse_args()
+  if not args.hosts and not args.file:
+    parser.error("no hosts to ping")
+  if args.timestamps and not hasattr(socket,"recvmsg"):
+    parser.error("--timestamps needs Python 3")
+  continuous=(args.continuous or args.count is not None or
+              args.deadline is not None)
+  if continuous and (args.sweep or args.file):
+    parser.error("--sweep pings every host once")
+  if args.file:
+    if args.hosts:
+      parser.error("give hosts either in --file or as arguments")
+    if args.file=="-":
+      hostListMain(sys.stdin,args)
+    else:
+      with open(args.file) as stream:
+        hostListMain(stream,args)
+    return None
+  if not args.sweep:
+    if len(args.hosts)>1:
+      parser.error("use --sweep to ping several hosts")
+    dest=resolve(args.hosts[0],args.family)
+    if continuous:
+      continuousMain(args.hosts[0],dest,args)
+      return None
+    delay=doOne(dest,args.timeout or 10,args.timestamps)
+    print(delay)
+    return None
 
-  dest=gethostbyname(sys.argv[1])
-  delay=doOne(dest)
-  print delay
+  results=sweep(expandTargets(args.hosts,args.family),args.timeout or 1,
+                args.rate,args.timestamps,args.batch)
+  for destAddr,delay in results.items():
+    if delay is None:
+      print("%-15s timeout" % destAddr)
+    else:
+      print("%-15s %.3f ms" % (destAddr,delay*1000))
   return None
 
 if __name__=='__main__':
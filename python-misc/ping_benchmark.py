@@ -0,0 +1,302 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+    ping_benchmark
+    ==============
+
+    Benchmarks the packet handling of :mod:`ping`.
+
+    `ping.checksum()` is timed against the original word by word loop on
+    random packets of typical sizes, after checking that both give the same
+    results.
+
+    `ping.sendOnePing()` and `ping.receiveOnePing()` are timed on their own
+    and in round trips, by default on an `EchoSocket`.  It answers every
+    request at once through a pair of Unix sockets, so neither the network
+    nor privileges are needed, and the delays measured in the round trips
+    are just the overhead of measuring them.  With ``--loopback`` a real
+    ICMP socket pings the addresses of 127.0.0.0/8 instead.  Besides the
+    packets per second, the CPU time per packet is reported, which includes
+    the time spent in the kernel.
+
+    Usage::
+
+        $ python ping_benchmark.py --repeat 5
+        $ sudo python ping_benchmark.py --loopback
+"""
+
+from __future__ import division
+
+import os
+import socket
+import random
+import resource
+from collections import deque
+from timeit import default_timer
+from argparse import ArgumentParser
+
+import ping
+
+
+def legacy_checksum(str):
+    """`ping.checksum()` before it summed the words in bulk."""
+    sum = 0
+    countTo = (len(str) // 2) * 2
+    count = 0
+    while count < countTo:
+        thisVal = ord(str[count + 1]) * 256 + ord(str[count])
+        sum = sum + thisVal
+        sum = sum & 0xffffffff
+        count = count + 2
+    if countTo < len(str):
+        sum = sum + ord(str[len(str) - 1])
+        sum = sum & 0xffffffff
+    sum = (sum >> 16) + (sum & 0xffff)
+    sum = sum + (sum >> 16)
+    answer = ~sum
+    answer = answer & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return answer
+
+
+#: Packet sizes in bytes: an empty echo request, the one of `ping.py`, an
+#: odd sized one, a full Ethernet frame and a jumbo frame.
+PACKET_SIZES = [8, 200, 201, 1500, 9000]
+
+
+def check_checksum(rng, count=2000):
+    """Compares `ping.checksum()` with `legacy_checksum()` on `count` random
+    packets of random length, also larger than `PACKET_SIZES`.
+
+    :raises AssertionError: for the first packet on which they differ.
+    """
+    for _ in range(count):
+        size = rng.choice([rng.randint(0, 64), rng.randint(0, 70000)])
+        packet = os.urandom(size)
+        expected = legacy_checksum(packet)
+        assert ping.checksum(packet) == expected, (size, expected)
+    # All bytes set make the sums as large as possible.
+    for size in PACKET_SIZES:
+        packet = b'\xff' * size
+        assert ping.checksum(packet) == legacy_checksum(packet), size
+
+
+def run_benchmark(function, packets, repeat):
+    """Calls `function` on each of `packets`, `repeat` times.
+
+    :returns: the best rate in packets per second.
+    """
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        for packet in packets:
+            function(packet)
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(packets) / best if best else 0
+
+
+class EchoSocket(object):
+    """Stands in for a raw ICMP socket.  Every request sent is answered at
+    once with an echo reply behind an IPv4 header, through a pair of Unix
+    sockets.
+
+    The socket buffers only hold about 150 replies of `ping.sendOnePing()`,
+    so at most `CAPACITY` requests should be sent before reading replies.
+    """
+
+    family = socket.AF_INET
+    type = socket.SOCK_RAW
+
+    #: An IPv4 header without options, of which only the length matters.
+    IP_HEADER = b'\x45' + b'\0' * 19
+    CAPACITY = 64
+
+    def __init__(self):
+        (self._replies, self._requests) = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._addresses = deque()
+
+    def sendto(self, packet, address):
+        # Only the type differs between echo requests and replies.
+        self._requests.send(self.IP_HEADER + b'\0' + packet[1:])
+        self._addresses.append(address)
+
+    def recvfrom(self, size, flags=0):
+        packet = self._replies.recv(size, flags)
+        return (packet, self._addresses.popleft())
+
+    def fileno(self):
+        return self._replies.fileno()
+
+    def close(self):
+        self._replies.close()
+        self._requests.close()
+
+
+def open_socket(loopback):
+    """Returns an ICMP socket, its ID and a function returning the
+    destination of the n-th request.  For `loopback` the socket is real and
+    the requests go to 127.0.0.1 through 127.0.255.254.
+    """
+    if not loopback:
+        return (EchoSocket(), os.getpid() & 0xFFFF, lambda n: '127.0.0.1')
+    (mySocket, myID) = ping.openIcmpSocket()
+    return (mySocket, myID,
+            lambda n: '127.0.%d.%d' % (n // 254 % 256, n % 254 + 1))
+
+
+def drain(mySocket):
+    """Reads all packets waiting on `mySocket`."""
+    try:
+        while True:
+            mySocket.recvfrom(1024, socket.MSG_DONTWAIT)
+    except socket.error:
+        pass
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Measurement(object):
+    """Sums the wall clock and CPU times spent in its ``with`` blocks."""
+
+    def __init__(self):
+        self.seconds = 0
+        self.cpu_seconds = 0
+
+    def __enter__(self):
+        self._start = (default_timer(), cpu_time())
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += default_timer() - self._start[0]
+        self.cpu_seconds += cpu_time() - self._start[1]
+
+
+def send_requests(mySocket, myID, destination, start, stop):
+    for sequence in xrange(start, stop):
+        ping.sendOnePing(mySocket, destination(sequence), myID,
+                         sequence & 0xFFFF)
+
+
+def benchmark_send(mySocket, myID, destination, count, chunk):
+    """Times `count` calls of `ping.sendOnePing()`, reading the replies
+    after every `chunk` requests.
+    """
+    measurement = Measurement()
+    for start in xrange(0, count, chunk):
+        with measurement:
+            send_requests(mySocket, myID, destination, start,
+                          min(start + chunk, count))
+        drain(mySocket)
+    return (measurement, None)
+
+
+def benchmark_receive(mySocket, myID, destination, count, chunk):
+    """Times `count` calls of `ping.receiveOnePing()`, sending the requests
+    `chunk` at a time beforehand.
+    """
+    measurement = Measurement()
+    for start in xrange(0, count, chunk):
+        stop = min(start + chunk, count)
+        send_requests(mySocket, myID, destination, start, stop)
+        with measurement:
+            for sequence in xrange(start, stop):
+                if ping.receiveOnePing(mySocket, myID, 1) is None:
+                    raise AssertionError('lost reply %d' % sequence)
+    return (measurement, None)
+
+
+def benchmark_round_trip(mySocket, myID, destination, count, chunk):
+    """Times `count` round trips of `ping.sendOnePing()` and
+    `ping.receiveOnePing()`.
+
+    :returns: the measurement and the average delay measured.
+    """
+    measurement = Measurement()
+    total_delay = 0
+    with measurement:
+        for sequence in xrange(count):
+            ping.sendOnePing(mySocket, destination(sequence), myID,
+                             sequence & 0xFFFF)
+            delay = ping.receiveOnePing(mySocket, myID, 1)
+            if delay is None:
+                raise AssertionError('lost reply %d' % sequence)
+            total_delay += delay
+    return (measurement, total_delay / count)
+
+
+#: Benchmarks of the socket functions by name.
+SOCKET_BENCHMARKS = [('sendOnePing', benchmark_send),
+                     ('receiveOnePing', benchmark_receive),
+                     ('round trip', benchmark_round_trip)]
+
+
+def run_socket_benchmark(benchmark, loopback, count, repeat):
+    """Runs `benchmark` on a fresh socket `repeat` times.
+
+    :returns: the measurement of the fastest run and its average delay.
+    """
+    best = None
+    for _ in range(repeat):
+        (mySocket, myID, destination) = open_socket(loopback)
+        try:
+            result = benchmark(mySocket, myID, destination, count,
+                               EchoSocket.CAPACITY)
+        finally:
+            mySocket.close()
+        if best is None or result[0].seconds < best[0].seconds:
+            best = result
+    return best
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the packet handling of '
+                            'ping.py.')
+    parser.add_argument('-n', '--packets', type=int, default=2000,
+                        help='Handle PACKETS packets in each benchmark '
+                        '(default: %(default)s).')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Report the best of REPEAT runs '
+                        '(default: %(default)s).')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Seed of the packet sizes of the check '
+                        '(default: %(default)s).')
+    parser.add_argument('-l', '--loopback', action='store_true',
+                        help='Ping 127.0.0.0/8 through a real ICMP socket, '
+                        'which needs root privileges or ICMP datagram '
+                        'sockets.')
+    args = parser.parse_args()
+
+    check_checksum(random.Random(args.seed))
+    print '%-9s %-9s %14s %8s' % ('function', 'size', 'packets/s', 'speedup')
+    print ':' * 43
+    for size in PACKET_SIZES:
+        packets = [os.urandom(size) for _ in range(args.packets)]
+        before = run_benchmark(legacy_checksum, packets, args.repeat)
+        after = run_benchmark(ping.checksum, packets, args.repeat)
+        print '%-9s %-9d %14.0f %8s' % ('legacy', size, before, '')
+        print '%-9s %-9d %14.0f %7.1fx' % ('checksum', size, after,
+                                           after / before)
+
+    print
+    print '%-15s %-9s %14s %10s %10s' % ('function', 'socket', 'packets/s',
+                                         'cpu us/pkt', 'delay us')
+    print ':' * 62
+    for name, benchmark in SOCKET_BENCHMARKS:
+        (measurement, delay) = run_socket_benchmark(
+            benchmark, args.loopback, args.packets, args.repeat)
+        print '%-15s %-9s %14.0f %10.2f %10s' % (
+            name, 'loopback' if args.loopback else 'echo',
+            args.packets / measurement.seconds,
+            measurement.cpu_seconds / args.packets * 1e6,
+            '' if delay is None else '%.1f' % (delay * 1e6))
+
+
+if __name__ == '__main__':
+    main()